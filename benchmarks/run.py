@@ -0,0 +1,173 @@
+import argparse
+from collections import OrderedDict as odict
+import gc
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from meleedat2json import DatFile
+from meleedat2json.events import Event, parseEvents
+from meleedat2json.jsonstream import writeDatFileJson
+from meleedat2json.synthetic import generateDatFile
+
+# Times the parser hot paths separately on a synthetic character file and reports throughput
+# and peak memory. Results can be appended to a history file (one JSON object per line) and
+# compared against the previous run to catch performance regressions.
+
+def collectEventOffsets(datFile):
+    offsets = []
+    for subaction in datFile.rootNodes[0].data.subactions:
+        offsets += [event.offset for event in subaction.events]
+    return offsets
+
+def stages(fileData, animFileData):
+    # name -> (setup, run), setup returns the argument for run, run returns the number of events processed
+    def parseAll(datFile):
+        events = 0
+        ftData = datFile.rootNodes[0].data
+        for subaction in ftData.subactions:
+            events += len(subaction.events)
+            subaction.animation
+        for subroutine in ftData.subroutines.values():
+            events += len(subroutine)
+        return events
+
+    def parseEventsAll(datFile):
+        events = 0
+        for subaction in datFile.rootNodes[0].data.subactions:
+            events += len(parseEvents(datFile.data, subaction.eventsOffset))
+        return events
+
+    def decodeEvents(args):
+        # the fields are decoded lazily, so they are accessed here
+        data, offsets = args
+        for offset in offsets:
+            Event(data, offset).fields
+        return len(offsets)
+
+    def prepareDecode():
+        datFile = DatFile(fileData, animFileData)
+        return datFile.data, collectEventOffsets(datFile)
+
+    def prepareJson():
+        return DatFile(fileData, animFileData).toJsonDict()
+
+    return odict([
+        ("DatFile", (lambda: None, lambda _: DatFile(fileData, animFileData) and 0)),
+        ("DatFile+parseAll", (lambda: None, lambda _: parseAll(DatFile(fileData, animFileData)))),
+        ("parseEvents", (lambda: DatFile(fileData, animFileData), parseEventsAll)),
+        ("Event+fields", (prepareDecode, decodeEvents)),
+        ("toJsonDict", (lambda: DatFile(fileData, animFileData), lambda datFile: datFile.toJsonDict() and 0)),
+        ("json.dump", (prepareJson, lambda dictData: json.dump(dictData, io.StringIO(), indent=4))),
+        ("writeDatFileJson", (lambda: DatFile(fileData, animFileData),
+            lambda datFile: writeDatFileJson(datFile, io.StringIO()))),
+    ])
+
+def timeStage(setup, run, repeat):
+    best = None
+    count = 0
+    for i in range(repeat):
+        arg = setup()
+        gc.collect()
+        start = time.perf_counter()
+        count = run(arg) or 0
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+
+    arg = setup()
+    gc.collect()
+    tracemalloc.start()
+    run(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, count, peak
+
+def gitRevision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def lastEntry(historyPath):
+    if not historyPath or not os.path.isfile(historyPath):
+        return None
+    entry = None
+    with open(historyPath) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+    return entry
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the meleedat2json parser on a synthetic character file")
+    parser.add_argument("--subactions", type=int, default=350, help="Number of subactions")
+    parser.add_argument("--events", type=int, nargs=2, default=[4, 16], metavar=("MIN", "MAX"), help="Events per subaction")
+    parser.add_argument("--subroutines", type=int, default=20, help="Number of subroutines")
+    parser.add_argument("--calls", type=int, default=1, help="Subroutine calls per subaction")
+    parser.add_argument("--animsize", type=int, default=0x200, help="Size of each animation, 0 for no AJ file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per stage, the fastest is reported")
+    parser.add_argument("--stage", action="append", default=None, help="Only run this stage (can be given multiple times)")
+    parser.add_argument("--history", default=None, help="Append the results to this file (JSON lines) and compare to the previous entry")
+    parser.add_argument("--threshold", type=float, default=None, help="Exit with an error if a stage is more than this many percent slower than in the previous history entry")
+    args = parser.parse_args()
+
+    fileData, animFileData = generateDatFile(seed=args.seed, subactionCount=args.subactions,
+        eventsPerSubaction=tuple(args.events), subroutineCount=args.subroutines,
+        subroutineCalls=args.calls, animationSize=args.animsize)
+    if len(animFileData) == 0:
+        animFileData = None
+    inputSize = len(fileData) + (len(animFileData) if animFileData else 0)
+
+    results = odict()
+    print("{:<18} {:>10} {:>14} {:>10} {:>12}".format("stage", "time [ms]", "events/s", "MB/s", "peak [KiB]"))
+    for name, (setup, run) in stages(fileData, animFileData).items():
+        if args.stage and name not in args.stage:
+            continue
+        duration, events, peak = timeStage(setup, run, args.repeat)
+        results[name] = odict([
+            ("duration", duration),
+            ("eventsPerSecond", events / duration if events and duration > 0 else None),
+            ("mbPerSecond", inputSize / duration / 1e6 if duration > 0 else None),
+            ("peakMemory", peak),
+        ])
+        print("{:<18} {:>10.2f} {:>14} {:>10.1f} {:>12.1f}".format(name, duration * 1000,
+            "{:.0f}".format(results[name]["eventsPerSecond"]) if results[name]["eventsPerSecond"] else "-",
+            results[name]["mbPerSecond"] or 0, peak / 1024))
+
+    previous = lastEntry(args.history)
+    regressions = []
+    if previous:
+        for name, result in results.items():
+            if name in previous["results"]:
+                change = (result["duration"] / previous["results"][name]["duration"] - 1) * 100
+                print("{:<18} {:+.1f}% vs. {}".format(name, change, previous.get("revision")))
+                if args.threshold is not None and change > args.threshold:
+                    regressions.append(name)
+
+    if args.history:
+        entry = odict([
+            ("time", time.time()),
+            ("revision", gitRevision()),
+            ("python", platform.python_version()),
+            ("inputSize", inputSize),
+            ("options", vars(args)),
+            ("results", results),
+        ])
+        with open(args.history, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    if len(regressions) > 0:
+        print("Regressions above {}%: {}".format(args.threshold, ", ".join(regressions)))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Measures the startup cost of the command line tool with python -X importtime.
+#
+# Targets:
+#   - "meleedat2json --help" and the subcommand dispatch do not import the parser
+#     (meleedat2json.meleedat2json, meleedat2json.events, bitstruct)
+#   - importing meleedat2json.cli takes less than 5 ms on top of the interpreter and argparse
+#   - importing the parser (meleedat2json.meleedat2json) takes less than 15 ms
+
+packageDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+targets = {
+    # module -> maximum cumulative import time in ms, not counting argparse
+    "meleedat2json.cli": 5,
+    "meleedat2json.meleedat2json": 15,
+}
+
+parserModules = ["meleedat2json.meleedat2json", "meleedat2json.events", "bitstruct"]
+
+def run(args, env):
+    return subprocess.run([sys.executable] + args, cwd=packageDir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+
+def importTimes(args, env):
+    # module -> (self us, cumulative us)
+    times = {}
+    for line in run(["-X", "importtime"] + args, env).stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line[12:]:
+            continue
+        selfTime, cumulative, module = line[12:].split("|")
+        if selfTime.strip().isdigit():
+            times[module.strip()] = (int(selfTime), int(cumulative))
+    return times
+
+def wallTime(args, env, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        run(args, env)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of meleedat2json")
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per measurement, the best is reported")
+    args = parser.parse_args()
+
+    # like an installed package, with cached bytecode
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    run(["-c", "import meleedat2json.meleedat2json"], env)
+
+    failed = []
+    print("{:<40} {:>10}".format("command", "wall [ms]"))
+    for command in (["-c", "pass"], ["-m", "meleedat2json", "--help"], ["-c", "import meleedat2json.meleedat2json"]):
+        print("{:<40} {:>10.1f}".format(" ".join(command), wallTime(command, env, args.repeat) * 1000))
+
+    helpImports = importTimes(["-m", "meleedat2json", "--help"], env)
+    for module in parserModules:
+        if module in helpImports:
+            failed.append("--help imports {}".format(module))
+
+    for module, target in targets.items():
+        times = [importTimes(["-c", "import argparse; import " + module], env) for i in range(args.repeat)]
+        cumulative = min(t[module][1] for t in times) / 1000
+        print("{:<40} {:>10.1f} (target < {} ms)".format("import " + module, cumulative, target))
+        if cumulative > target:
+            failed.append("import {} took {:.1f} ms".format(module, cumulative))
+
+    for failure in failed:
+        print("Target missed:", failure)
+    if len(failed) > 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,21 @@
-from .meleedat2json import *
+import importlib
+
+# The parser is only imported when one of its names is first accessed, so that the command line
+# tool (cli.main) starts without loading it.
+
+def __getattr__(name):
+    if name == "main":
+        return importlib.import_module(".cli", __name__).main
+    module = importlib.import_module(".meleedat2json", __name__)
+    if name == "__all__":
+        return [name for name in vars(module) if not name.startswith("_")] + ["main"]
+    # submodules imported by the parser (events, attributes, ...) are set on the package
+    if name in globals():
+        return globals()[name]
+    try:
+        return getattr(module, name)
+    except AttributeError:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name)) from None
+
+def __dir__():
+    return sorted(set(globals()) | set(__getattr__("__all__")))
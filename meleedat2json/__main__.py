@@ -1,4 +1,4 @@
-from meleedat2json import main
+from meleedat2json.cli import main
 
 if __name__ == "__main__":
     main()
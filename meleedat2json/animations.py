@@ -0,0 +1,209 @@
+from collections import OrderedDict as odict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import struct
+
+from .meleedat2json import DatFile, FigaTree, decodeString
+from .instrumentation import metrics
+
+# Extracts the animations of a character from its Pl**AJ.dat. Subactions that share an
+# animation (same offset and size in the AJ file) are written once and hard linked for the
+# other subactions. The files are written by a thread pool, directly from the memory mapped
+# AJ file.
+#
+# Optionally the figatrees are decoded into NumPy tables (.npz next to the .dat, requires numpy):
+#   bones: number of tracks per bone
+#   tracks: one row per track, keys of track i are keys[firstKey:firstKey+keyCount]
+#   keys: one row per keyframe, value/tangent are NaN if the key does not have one
+# https://github.com/Ploaj/HSDLib (HSDRaw/Tools/FOBJ_Decoder.cs) for the keyframe format
+
+# dataLength, (padding), trackType, valueFormat, tangentFormat, (padding), dataOffset
+trackStruct = struct.Struct(">H2xBBBxI")
+
+# interpolation types of keyframes
+interpolationNames = {
+    0: "none",
+    1: "constant",
+    2: "linear",
+    3: "spline0",
+    4: "spline",
+    5: "slope",
+    6: "key",
+}
+
+# upper 3 bits of valueFormat/tangentFormat, the lower 5 bits are the scale exponent
+valueStructs = {
+    0x00: struct.Struct(">f"),
+    0x20: struct.Struct(">h"),
+    0x40: struct.Struct(">H"),
+    0x60: struct.Struct(">b"),
+    0x80: struct.Struct(">B"),
+}
+
+def animationFileName(index, subaction):
+    name = str(index)
+    if len(subaction.name) > 0:
+        name += " - " + decodeString(subaction.shortName)
+    return name
+
+def uniqueAnimations(ftData):
+    # (animationOffset, animationSize) -> indices of the subactions using it, in order
+    animations = odict()
+    for i, subaction in enumerate(ftData.subactions):
+        animations.setdefault((subaction.animationOffset, subaction.animationSize), []).append(i)
+    return animations
+
+def readVarUint(data, pos):
+    # 7 bits per byte, the high bit is set if another byte follows
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte & 0x80 == 0:
+            return value, pos
+
+def readValue(data, pos, valueFormat):
+    valueStruct = valueStructs.get(valueFormat & 0xE0)
+    if valueStruct is None:
+        raise ValueError("Unknown keyframe value format {}".format(hex(valueFormat)))
+    value = valueStruct.unpack_from(data, pos)[0]
+    if valueFormat & 0xE0 != 0:
+        value /= 1 << (valueFormat & 0x1F)
+    return value, pos + valueStruct.size
+
+def decodeKeys(data, offset, length, valueFormat, tangentFormat):
+    # returns a list of (interpolation, frame, value, tangent)
+    keys = []
+    frame = 0
+    pos = offset
+    end = offset + length
+    if end > len(data):
+        raise ValueError("Keyframe data at {} is out of bounds".format(hex(offset)))
+    while pos < end:
+        byte = data[pos]
+        pos += 1
+        interpolation = byte & 0x0F
+        if interpolation not in interpolationNames or interpolation == 0:
+            raise ValueError("Unknown interpolation {} at {}".format(interpolation, hex(pos - 1)))
+        keyCount = (byte >> 4) & 0x07
+        shift = 3
+        while byte & 0x80:
+            byte = data[pos]
+            pos += 1
+            keyCount += (byte & 0x7F) << shift
+            shift += 7
+        keyCount += 1
+
+        for i in range(keyCount):
+            value = tangent = float("nan")
+            wait = 0
+            if interpolation in (1, 2, 3): # constant, linear, spline0
+                value, pos = readValue(data, pos, valueFormat)
+                wait, pos = readVarUint(data, pos)
+            elif interpolation == 4: # spline
+                value, pos = readValue(data, pos, valueFormat)
+                tangent, pos = readValue(data, pos, tangentFormat)
+                wait, pos = readVarUint(data, pos)
+            elif interpolation == 5: # slope
+                tangent, pos = readValue(data, pos, tangentFormat)
+            else: # key
+                value, pos = readValue(data, pos, valueFormat)
+            keys.append((interpolation, frame, value, tangent))
+            frame += wait
+    return keys
+
+def decodeFigaTree(datFile, figaTree):
+    # returns (bones, tracks, keys), tracks are (bone, trackType, valueFormat, tangentFormat, firstKey, keyCount)
+    data = datFile.data
+    bones = []
+    pos = figaTree.boneTableOffset
+    while data[pos] != 0xFF:
+        bones.append(data[pos])
+        pos += 1
+
+    tracks = []
+    keys = []
+    trackOffset = figaTree.animDataOffset
+    for bone, trackCount in enumerate(bones):
+        for i in range(trackCount):
+            dataLength, trackType, valueFormat, tangentFormat, dataOffset = trackStruct.unpack_from(data, trackOffset)
+            trackOffset += trackStruct.size
+            trackKeys = decodeKeys(data, dataOffset, dataLength, valueFormat, tangentFormat)
+            tracks.append((bone, trackType, valueFormat, tangentFormat, len(keys), len(trackKeys)))
+            keys += trackKeys
+    return bones, tracks, keys
+
+def createFile(path):
+    # a hard link at path from an earlier run (shared with other subactions) is removed first,
+    # so it is not written through
+    if os.path.lexists(path):
+        os.remove(path)
+    return open(path, "wb")
+
+def writeDecodedAnimation(path, animationData):
+    import numpy as np
+    datFile = DatFile(animationData)
+    figaTree = datFile.rootNodes[0].data
+    if not isinstance(figaTree, FigaTree):
+        raise ValueError("Not a figatree: {}".format(datFile.rootNodes[0].name))
+    bones, tracks, keys = decodeFigaTree(datFile, figaTree)
+    with createFile(path) as f:
+        np.savez(f,
+            numFrames=np.float32(figaTree.numFrames),
+            bones=np.array(bones, dtype=np.uint8),
+            tracks=np.array(tracks, dtype=[("bone", np.uint16), ("trackType", np.uint8), ("valueFormat", np.uint8),
+                ("tangentFormat", np.uint8), ("firstKey", np.uint32), ("keyCount", np.uint32)]),
+            keys=np.array(keys, dtype=[("interpolation", np.uint8), ("frame", np.float32),
+                ("value", np.float32), ("tangent", np.float32)]))
+
+def writeAnimation(path, animationData, decode):
+    with createFile(path + ".dat") as f:
+        if animationData is not None:
+            f.write(animationData)
+    if decode and animationData is not None:
+        writeDecodedAnimation(path + ".npz", animationData)
+
+def linkAnimation(sourcePath, path, decode):
+    for extension in [".dat", ".npz"] if decode else [".dat"]:
+        if not os.path.isfile(sourcePath + extension):
+            continue
+        if os.path.lexists(path + extension):
+            os.remove(path + extension)
+        try:
+            os.link(sourcePath + extension, path + extension)
+        except OSError:
+            # e.g. file systems without hard links
+            with open(sourcePath + extension, "rb") as source, open(path + extension, "wb") as f:
+                f.write(source.read())
+
+def extractAnimations(datFile, outDir, decode=False, workers=None):
+    # Writes "<index> - <name>.dat" (and .npz if decode) for every subaction to outDir.
+    # Returns a list of (subaction index, error) for animations that could not be decoded.
+    ftData = datFile.rootNodes[0].data
+    os.makedirs(outDir, exist_ok=True)
+    animations = uniqueAnimations(ftData)
+    metrics.count("animationsUnique", len(animations))
+    metrics.count("animationsShared", len(ftData.subactions) - len(animations))
+
+    def path(index):
+        return os.path.join(outDir, animationFileName(index, ftData.subactions[index]))
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = odict()
+        for indices in animations.values():
+            futures[indices[0]] = executor.submit(writeAnimation, path(indices[0]),
+                ftData.subactions[indices[0]].animationData, decode)
+        for index, future in futures.items():
+            try:
+                future.result()
+            except (ValueError, IndexError, struct.error) as e:
+                errors.append((index, e))
+
+    for indices in animations.values():
+        for index in indices[1:]:
+            linkAnimation(path(indices[0]), path(index), decode)
+    return errors
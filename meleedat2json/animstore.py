@@ -0,0 +1,128 @@
+from collections import OrderedDict as odict
+import hashlib
+import os
+
+from .meleedat2json import DatFile, asView, isPath, releaseView, closeMapping
+from .instrumentation import metrics
+
+# Animations shared between DatFiles. Character files that use the same Pl**AJ.dat (or AJ files
+# with the same contents, e.g. in variant packs) share one buffer and every figatree is parsed
+# once per (AJ file, animationOffset, animationSize):
+#
+#   store = AnimationStore()
+#   DatFile("PlZd.dat", "PlZdAJ.dat", animationStore=store)
+#
+# AJ files are identified by a hash of their contents, so the same file under different paths
+# is only kept once. Batch workers can attach AJ files the parent put into shared memory
+# (see addSharedAnimFile and batch.py). The parsed animations are kept in an LRU of
+# maxAnimations entries. close() closes the files and segments the store opened.
+
+def contentKey(data):
+    return "blake2b:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+class AnimationStore(object):
+    def __init__(self, maxAnimations=4096):
+        # content key -> view of the AJ file
+        self.animFiles = {}
+        # (path, size, mtime) -> content key
+        self.paths = {}
+        # (content key, animationOffset, animationSize) -> DatFile of the figatree, least
+        # recently used first
+        self.animations = odict()
+        self.maxAnimations = maxAnimations
+        # SharedMemory objects, which have to stay open while their views are used
+        self.sharedMemory = {}
+        # mappings of the AJ files that were passed as paths
+        self.mappings = []
+
+    def openAnimFile(self, animFileData):
+        # returns (content key, view). animFileData may be anything DatFile accepts or the
+        # key of an AJ file that was already added.
+        if isinstance(animFileData, str) and animFileData in self.animFiles:
+            return animFileData, self.animFiles[animFileData]
+
+        pathKey = None
+        if isinstance(animFileData, (str, os.PathLike)):
+            stat = os.stat(animFileData)
+            pathKey = (os.path.realpath(animFileData), stat.st_size, stat.st_mtime_ns)
+            if pathKey in self.paths:
+                key = self.paths[pathKey]
+                return key, self.animFiles[key]
+
+        view = asView(animFileData)
+        key = contentKey(view)
+        if pathKey is not None:
+            self.paths[pathKey] = key
+        if key in self.animFiles:
+            metrics.count("animFilesShared")
+            if isPath(animFileData):
+                mapping = view.obj
+                releaseView(view)
+                closeMapping(mapping)
+        else:
+            self.animFiles[key] = view
+            if isPath(animFileData):
+                self.mappings.append(view.obj)
+        return key, self.animFiles[key]
+
+    def addSharedAnimFile(self, name, size, key):
+        # attach an AJ file that another process put into a SharedMemory segment
+        if key in self.animFiles:
+            return key
+        # Only the process that created the segment unlinks it. Before Python 3.13 attaching
+        # always registers the segment with the resource tracker, which forked workers share with
+        # the parent, so that is the parent's registration and must not be unregistered here.
+        from multiprocessing import shared_memory
+        try:
+            segment = shared_memory.SharedMemory(name, track=False)
+        except TypeError:
+            segment = shared_memory.SharedMemory(name)
+        self.sharedMemory[key] = segment
+        self.animFiles[key] = segment.buf[:size]
+        return key
+
+    def getAnimation(self, key, offset, size):
+        # DatFile of the figatree at offset in the AJ file with this key
+        animationKey = (key, offset, size)
+        animation = self.animations.get(animationKey)
+        if animation is None:
+            with metrics.timer("animationDatFile"):
+                animation = DatFile(self.animFiles[key][offset:offset+size])
+            metrics.count("animationFilesParsed")
+            self.animations[animationKey] = animation
+            # evicted animations are still valid for the DatFiles using them
+            while len(self.animations) > self.maxAnimations:
+                self.animations.popitem(last=False)
+        else:
+            self.animations.move_to_end(animationKey)
+            metrics.count("animationStoreHits")
+        return animation
+
+    def close(self):
+        # DatFiles using the store can't be used afterwards
+        for animation in self.animations.values():
+            animation.close()
+        self.animations = odict()
+        for view in self.animFiles.values():
+            releaseView(view)
+        self.animFiles = {}
+        self.paths = {}
+        for mapping in self.mappings:
+            closeMapping(mapping)
+        self.mappings = []
+        for segment in self.sharedMemory.values():
+            try:
+                segment.close()
+            except BufferError:
+                # views of it are still used, it is unmapped when the process exits
+                pass
+        self.sharedMemory = {}
+
+def createSharedAnimFile(path):
+    # copies the AJ file at path into a new SharedMemory segment, returns (segment, key)
+    from multiprocessing import shared_memory
+    with open(path, "rb") as f:
+        data = f.read()
+    segment = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    segment.buf[:len(data)] = data
+    return segment, contentKey(data)
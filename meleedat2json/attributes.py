@@ -1,3 +1,6 @@
+from collections import Counter
+import struct
+
 # https://github.com/Adjective-Object/melee_subaction_unpacker/blob/master/src/dolfs/ftdata.hpp#L55
 attributesList = [
     ("f", "initialWalkVelocity"),
@@ -98,3 +101,10 @@ attributesList = [
     ("I", "specialJumpAction"), # -1 for special
     ("I", "weightDepThrowSpeedFlags"),
 ]
+
+# the whole attribute block, compiled once
+attributesStruct = struct.Struct(">" + "".join(typeChar for typeChar, name in attributesList))
+
+# name -> index in attributesList, for names that are unique (not "?")
+nameCounts = Counter(name for typeChar, name in attributesList)
+attributeIndices = {name: i for i, (typeChar, name) in enumerate(attributesList) if nameCounts[name] == 1}
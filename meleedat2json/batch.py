@@ -0,0 +1,157 @@
+import argparse
+from collections import OrderedDict as odict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import fnmatch
+import json
+import os
+import sys
+import time
+import traceback
+
+from .meleedat2json import DatFile, getAnimFilePath, getBytesFormat, dumpJson
+from .cache import ParseCache
+from .animstore import AnimationStore, createSharedAnimFile
+from .instrumentation import metrics
+from .cli import addOutputArguments
+
+# animations shared between the files dumped by one worker process, see --shareanims
+workerAnimationStore = None
+
+def findDatFiles(inputDir, pattern):
+    # pairs of (datFilePath, animFilePath or None)
+    pairs = []
+    for fileName in sorted(os.listdir(inputDir)):
+        if not fnmatch.fnmatch(fileName, pattern) or fileName.endswith("AJ.dat"):
+            continue
+        datFilePath = os.path.join(inputDir, fileName)
+        animFilePath = getAnimFilePath(datFilePath)
+        if not os.path.isfile(animFilePath):
+            animFilePath = None
+        pairs.append((datFilePath, animFilePath))
+    return pairs
+
+def fileEntry(datFilePath, animFilePath, outFilePath):
+    return odict([
+        ("sourceFile", datFilePath),
+        ("animFile", animFilePath),
+        ("outFile", outFilePath),
+    ])
+
+# runs in a worker process
+# sharedAnimFile is None or (shared memory name, size, content key) of the AJ file
+def dumpFile(datFilePath, animFilePath, outFilePath, cacheDir=None, cacheSize=None,
+        compact=False, bytesFormat="hex", collectMetrics=False, sharedAnimFile=None):
+    global workerAnimationStore
+    entry = fileEntry(datFilePath, animFilePath, outFilePath)
+    metrics.enable(collectMetrics)
+    metrics.reset()
+    startTime = time.time()
+    try:
+        animationStore = None
+        animFileData = animFilePath
+        if sharedAnimFile:
+            if workerAnimationStore is None:
+                workerAnimationStore = AnimationStore()
+                # closes the SharedMemory handles when the worker exits
+                from multiprocessing import util
+                util.Finalize(workerAnimationStore, workerAnimationStore.close, exitpriority=10)
+            animationStore = workerAnimationStore
+            animFileData = animationStore.addSharedAnimFile(*sharedAnimFile)
+        if cacheDir:
+            if animationStore is not None:
+                animFileData = animationStore.animFiles[animFileData]
+            dictData = ParseCache(cacheDir, cacheSize).getJsonDict(datFilePath, animFileData,
+                compact, bytesFormat)
+        else:
+            with metrics.timer("DatFile"):
+                datFile = DatFile(datFilePath, animFileData, animationStore)
+            with datFile, metrics.timer("toJsonDict"):
+                dictData = datFile.toJsonDict(compact, bytesFormat)
+        with open(outFilePath, "w") as f, metrics.timer("json.dump"):
+            dumpJson(dictData, datFilePath, f, compact)
+        entry["outSize"] = os.path.getsize(outFilePath)
+    except Exception:
+        entry["error"] = traceback.format_exc()
+    entry["duration"] = time.time() - startTime
+    if collectMetrics:
+        entry["metrics"] = metrics.summary()
+    return entry
+
+def dumpDirectory(inputDir, outputDir, pattern="Pl??.dat", workers=None, cacheDir=None, cacheSize=256*1024*1024,
+        compact=False, bytesFormat="hex", collectMetrics=False, shareAnimations=False):
+    # shareAnimations reads every AJ file once into shared memory (AJ files with the same
+    # contents share a segment) and the workers parse every animation once
+    os.makedirs(outputDir, exist_ok=True)
+    startTime = time.time()
+    pairs = findDatFiles(inputDir, pattern)
+    segments = {}
+    sharedAnimFiles = {}
+    try:
+        if shareAnimations:
+            for datFilePath, animFilePath in pairs:
+                if animFilePath is None or animFilePath in sharedAnimFiles:
+                    continue
+                segment, key = createSharedAnimFile(animFilePath)
+                if key in segments:
+                    segment.close()
+                    segment.unlink()
+                else:
+                    segments[key] = segment
+                sharedAnimFiles[animFilePath] = (segments[key].name, os.path.getsize(animFilePath), key)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for datFilePath, animFilePath in pairs:
+                outFileName = os.path.splitext(os.path.basename(datFilePath))[0] + ".json"
+                outFilePath = os.path.join(outputDir, outFileName)
+                futures.append((fileEntry(datFilePath, animFilePath, outFilePath), executor.submit(dumpFile,
+                    datFilePath, animFilePath, outFilePath, cacheDir, cacheSize, compact, bytesFormat,
+                    collectMetrics, sharedAnimFiles.get(animFilePath))))
+            files = []
+            for entry, future in futures:
+                try:
+                    files.append(future.result())
+                except BrokenProcessPool as e:
+                    # a worker died (e.g. out of memory), the files it and the pool had left fail
+                    entry["error"] = "{}: {}".format(type(e).__name__, e)
+                    files.append(entry)
+    finally:
+        for segment in segments.values():
+            segment.close()
+            segment.unlink()
+
+    return odict([
+        ("inputDir", inputDir),
+        ("workers", workers or os.cpu_count()),
+        ("duration", time.time() - startTime),
+        ("files", files),
+    ])
+
+def batchMain(argv=None):
+    parser = argparse.ArgumentParser(prog="meleedat2json batch",
+        description="Dump all character .dat files in a directory (e.g. the extracted Melee ISO) to JSON in parallel")
+    parser.add_argument("inputdir", help="Directory containing the Pl**.dat and Pl**AJ.dat files")
+    parser.add_argument("outputdir", help="Directory the JSON files (and the manifest) are written to")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--pattern", default="Pl??.dat", help="Glob pattern for the .dat files to dump. Pl**AJ.dat files are always skipped.")
+    parser.add_argument("--manifest", default="manifest.json", help="File name of the manifest (outputs, timings and errors) in the output directory")
+    addOutputArguments(parser)
+    parser.add_argument("--metrics", default=False, action="store_true", help="Include stage timings and counters for every file in the manifest")
+    parser.add_argument("--shareanims", default=False, action="store_true", help="Read every AJ file once into shared memory and parse every animation once per worker. Helps with variant packs, where many files use the same AJ file.")
+    args = parser.parse_args(argv)
+
+    manifest = dumpDirectory(args.inputdir, args.outputdir, args.pattern, args.workers,
+        args.cache, args.cachesize*1024*1024, args.compact, getBytesFormat(args.bytes, args.compact),
+        args.metrics, args.shareanims)
+    manifestPath = os.path.join(args.outputdir, args.manifest)
+    with open(manifestPath, "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    failed = [entry for entry in manifest["files"] if "error" in entry]
+    print("Dumped {} files in {:.2f}s ({} failed), manifest written to {}".format(
+        len(manifest["files"]), manifest["duration"], len(failed), manifestPath))
+    for entry in failed:
+        print("Failed: {}\n{}".format(entry["sourceFile"], entry["error"]))
+    if len(failed) > 0:
+        sys.exit(1)
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+
+from .meleedat2json import DatFile, openView
+from .events import eventTypes
+from .attributes import attributesList
+from .instrumentation import metrics
+
+# On-disk cache of DatFile.toJsonDict() results, keyed by a hash of the .dat and AJ file contents
+# and a stamp of the parser tables, so that unchanged files don't have to be parsed again.
+# Entries are zlib compressed pickles. The least recently used entries are evicted once the
+# cache directory grows beyond maxSize bytes.
+
+# increment this if the output of toJsonDict changes in a way that is not covered by schemaStamp()
+cacheFormatVersion = 1
+
+def schemaStamp():
+    stamp = hashlib.sha256()
+    stamp.update(str(cacheFormatVersion).encode("utf-8"))
+    for commandId in sorted(eventTypes, key=str):
+        eventType = eventTypes[commandId]
+        fieldFormat = eventType.fields[0] if eventType.fields else None
+        postProcess = eventType.postProcess.__name__ if eventType.postProcess else None
+        stamp.update(repr((commandId, eventType.length, eventType.name, fieldFormat,
+            eventType.fieldNames, postProcess)).encode("utf-8"))
+    stamp.update(repr(attributesList).encode("utf-8"))
+    return stamp.hexdigest()
+
+class ParseCache(object):
+    suffix = ".pickle.z"
+
+    # schema is the EventSchema passed to DatFile, None for the default one
+    def __init__(self, directory, maxSize=256*1024*1024, schema=None):
+        self.directory = directory
+        self.maxSize = maxSize
+        self.schema = schema
+        self.stamp = schemaStamp()
+        if schema is not None:
+            self.stamp += schema.stamp()
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, fileData, animFileData=None, compact=False, bytesFormat="hex"):
+        h = hashlib.sha256(self.stamp.encode("utf-8"))
+        h.update(repr((compact, bytesFormat)).encode("utf-8"))
+        for data in (fileData, animFileData):
+            if data is None:
+                h.update(b"none")
+            else:
+                with openView(data) as view:
+                    h.update(len(view).to_bytes(8, "big"))
+                    h.update(view)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            value = pickle.loads(zlib.decompress(data))
+        except Exception:
+            # a corrupt entry can raise almost anything while unpickling, it is a miss
+            metrics.count("parseCacheCorrupt")
+            return None
+        # the modification time is used as the access time for the LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by another process in the meantime
+            pass
+        return value
+
+    def put(self, key, value):
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if len(data) > self.maxSize:
+            # would be evicted right away
+            metrics.count("parseCacheTooLarge")
+            return
+        # write to a temporary file first, so concurrent readers never see partial entries
+        fd, tempPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tempPath, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        totalSize = 0
+        for fileName in os.listdir(self.directory):
+            if not fileName.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, fileName)
+            try:
+                stat = os.stat(path)
+            except OSError: # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            totalSize += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if totalSize <= self.maxSize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            totalSize -= size
+
+    def getJsonDict(self, fileData, animFileData=None, compact=False, bytesFormat="hex", datFile=None):
+        # fileData and animFileData may be anything DatFile accepts
+        # compact and bytesFormat are passed to DatFile.toJsonDict
+        # datFile is an optional DatFile of the same data, used on a miss instead of a new one
+        with openView(fileData) as fileData, openView(animFileData) as animFileData:
+            with metrics.timer("parseCache.key"):
+                key = self.key(fileData, animFileData, compact, bytesFormat)
+            with metrics.timer("parseCache.get"):
+                dictData = self.get(key)
+            if dictData is None:
+                metrics.count("parseCacheMisses")
+                with metrics.timer("toJsonDict"):
+                    if datFile is not None:
+                        dictData = datFile.toJsonDict(compact, bytesFormat)
+                    else:
+                        with DatFile(fileData, animFileData, schema=self.schema) as datFile:
+                            dictData = datFile.toJsonDict(compact, bytesFormat)
+                with metrics.timer("parseCache.put"):
+                    self.put(key, dictData)
+            else:
+                metrics.count("parseCacheHits")
+        return dictData
@@ -0,0 +1,160 @@
+import argparse
+import contextlib
+import importlib
+import os
+import sys
+import time
+
+# The command line interface. Only argparse and the standard modules above are imported up front,
+# the parser (bitstruct, eventTypes, ...) is imported once the arguments are parsed and only the
+# modules needed for the requested options are loaded. See benchmarks/startup.py.
+
+# subcommand -> (module, function), only imported if used
+subcommands = {
+    "batch": (".batch", "batchMain"),
+    "diff": (".datdiff", "diffMain"),
+    "index": (".sqlindex", "indexMain"),
+    "query": (".sqlindex", "queryMain"),
+    "serve": (".server", "serveMain"),
+}
+
+def addOutputArguments(parser):
+    # the options for the JSON output and the parse cache, shared with the batch subcommand.
+    # --bytes is turned into a bytesFormat with meleedat2json.getBytesFormat.
+    parser.add_argument("--cache", default=None, help="Directory for a cache of parse results, keyed by the contents of the .dat and AJ file. Unchanged files are not parsed again.")
+    parser.add_argument("--cachesize", type=int, default=256, help="Maximum size of the cache directory in MiB. The least recently used entries are removed first.")
+    parser.add_argument("--compact", default=False, action="store_true", help="Write smaller JSON: no indentation, numeric command ids and no event bytes (unless --bytes is given). Includes a schemaVersion.")
+    parser.add_argument("--bytes", default=None, choices=["hex", "base64", "none"], help="How the raw bytes of events are written. Defaults to hex, or none with --compact.")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in subcommands:
+        module, function = subcommands[sys.argv[1]]
+        getattr(importlib.import_module(module, __package__), function)(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description='Dump Melee .dat files to JSON',
+        epilog="Use 'meleedat2json batch --help' to dump a whole directory of .dat files in parallel. "
+            "'meleedat2json index' and 'meleedat2json query' build and query an SQLite database of many files. "
+            "'meleedat2json serve' runs a server that parses files sent over a local socket. "
+            "'meleedat2json diff' lists the changes between two versions of a .dat file.")
+    parser.add_argument('datfile', help='The .dat file')
+    parser.add_argument("outfile", help="Path to output JSON file.")
+    parser.add_argument("-a", "--animfile", default=None, help="Path to the corresponding animation file. If nothing is given an Pl**AJ.dat file will be looked for next to the PJ**.dat (the input)")
+    parser.add_argument("--dumpanims", default=False, action="store_true", help="Dumps animation files from the Pl**AJ.dat to separate files (per subaction). Subactions sharing an animation get hard links to the same file.")
+    parser.add_argument("--decodeanims", default=False, action="store_true", help="With --dumpanims, also decode the bone tables and keyframes of the animations to .npz files. Requires numpy.")
+    parser.add_argument("--animpath", default="animationFiles", help="Directory to where the animations from Pl**AJ.dat should be dumped to.")
+    parser.add_argument("--npz", default=None, help="Also export the subactions, events and decoded event fields as NumPy tables to this .npz file (or directory of .npy files if it does not end in .npz). Requires numpy.")
+    addOutputArguments(parser)
+    parser.add_argument("--schema", default=None, help="JSON file with event definitions that override the default ones (see schema.py), e.g. for hacks that add or change events")
+    parser.add_argument("--strict", default=False, action="store_true", help="Check the event streams before dumping and stop with an error if the file is malformed (e.g. streams without exit or running past the data)")
+    parser.add_argument("--time", default=False, action="store_true", help="Print how long each stage of the dump took and how much work was done. Mainly for optimization.")
+    parser.add_argument("--metrics", default=None, help="Write the stage timings and counters as JSON to this file")
+    parser.add_argument("--profile", default=None, help="Run under cProfile and write the stats to this file (readable with pstats)")
+    args = parser.parse_args()
+
+    from .instrumentation import metrics
+    if args.time or args.metrics:
+        metrics.enable()
+
+    startTime = time.time()
+    if args.profile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.runcall(dump, args)
+        profile.dump_stats(args.profile)
+    else:
+        dump(args)
+
+    if args.time:
+        metrics.report(sys.stdout)
+        print("Duration: {}s".format(time.time() - startTime))
+    if args.metrics:
+        metrics.write(args.metrics)
+
+def dump(args):
+    from .meleedat2json import openView, getAnimFilePath
+    from .events import MalformedDataError
+    from .instrumentation import metrics
+
+    if args.animfile:
+        ajFilePath = args.animfile
+    else:
+        ajFilePath = getAnimFilePath(args.datfile)
+
+    if os.path.isfile(ajFilePath):
+        animFilePath = ajFilePath
+    else:
+        print("Pl**AJ.dat file not found in '{}'".format(ajFilePath))
+        print("You can pass --animfile to pass the path to the AJ file directly")
+        animFilePath = None
+
+    # both files are memory mapped, the mappings are closed when the dump is done
+    with contextlib.ExitStack() as stack:
+        with metrics.timer("readFiles"):
+            fileData = stack.enter_context(openView(args.datfile))
+            animFileData = stack.enter_context(openView(animFilePath))
+        try:
+            dumpData(args, fileData, animFileData)
+        except MalformedDataError as e:
+            print("{} is malformed: {}".format(args.datfile, e))
+            sys.exit(1)
+
+def dumpData(args, fileData, animFileData):
+    from .meleedat2json import DatFile, getBytesFormat, dumpJson
+    from .instrumentation import metrics
+
+    schema = None
+    if args.schema:
+        from .schema import loadSchema
+        try:
+            schema = loadSchema(args.schema)
+        except ValueError as e:
+            print("{} is not a valid schema: {}".format(args.schema, e))
+            sys.exit(1)
+    # with --cache the DatFile is only built on a miss, unless the other options need it
+    file = None
+    if args.strict or args.dumpanims or args.npz or not args.cache:
+        with metrics.timer("DatFile"):
+            file = DatFile(fileData, animFileData, strict=args.strict, schema=schema)
+    try:
+        if args.strict:
+            with metrics.timer("validate"):
+                file.validate()
+
+        # Dump Anims
+        if args.dumpanims:
+            from .animations import extractAnimations
+            with metrics.timer("dumpAnims"):
+                assert file.animFileData
+                assert file.rootNodes[0].name.startswith(b"ftData")
+                errors = extractAnimations(file, args.animpath, args.decodeanims)
+            for index, error in errors:
+                print("Could not decode the animation of subaction {}: {}".format(index, error))
+
+        # Export NumPy tables
+        if args.npz:
+            from .npzexport import exportTables, writeTables
+            assert file.rootNodes[0].name.startswith(b"ftData")
+            print("Exporting tables to {}..".format(args.npz))
+            with metrics.timer("exportTables"):
+                writeTables(args.npz, exportTables(file, file.rootNodes[0].data))
+
+        # Save to JSON
+        bytesFormat = getBytesFormat(args.bytes, args.compact)
+        print("Saving to {}..".format(args.outfile))
+        with open(args.outfile, "w") as f:
+            if args.cache:
+                from .cache import ParseCache
+                dictData = ParseCache(args.cache, args.cachesize*1024*1024, schema).getJsonDict(fileData, animFileData,
+                    args.compact, bytesFormat, file)
+                with metrics.timer("json.dump"):
+                    dumpJson(dictData, args.datfile, f, args.compact)
+            else:
+                # written incrementally, without building the whole dict first
+                from .jsonstream import writeDatFileJson
+                with metrics.timer("writeDatFileJson"):
+                    writeDatFileJson(file, f, sourceFile=os.path.basename(args.datfile),
+                        compact=args.compact, bytesFormat=bytesFormat)
+    finally:
+        if file is not None:
+            file.close()
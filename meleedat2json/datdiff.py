@@ -0,0 +1,240 @@
+import argparse
+from bisect import bisect_right
+from collections import OrderedDict as odict
+import difflib
+import json
+import sys
+
+from .meleedat2json import DatFile, FtData, StreamScans, decodeString
+from .attributes import attributesList
+
+# Structural diff of two versions of a character .dat file. The data blocks are compared first
+# and only the attributes, subactions and subroutines whose bytes changed are decoded, so the
+# work depends on the size of the edit, not the size of the file. Events are listed as
+# added/removed/changed with their decoded fields.
+
+chunkSize = 4096
+
+headerFields = ["fileSize", "dataBlockSize", "relocationTableCount", "rootCount", "rootCount2"]
+subactionFields = ["animationOffset", "animationSize", "eventsOffset", "posFlags", "characterId"]
+
+def changedRanges(oldData, newData):
+    # sorted, merged list of (start, end) byte ranges that differ, for data of the same size
+    assert len(oldData) == len(newData)
+    ranges = []
+    for chunkStart in range(0, len(oldData), chunkSize):
+        chunkEnd = min(chunkStart + chunkSize, len(oldData))
+        oldChunk = bytes(oldData[chunkStart:chunkEnd])
+        newChunk = bytes(newData[chunkStart:chunkEnd])
+        if oldChunk == newChunk:
+            continue
+        for i in range(len(oldChunk)):
+            if oldChunk[i] != newChunk[i]:
+                offset = chunkStart + i
+                if len(ranges) > 0 and ranges[-1][1] == offset:
+                    ranges[-1][1] = offset + 1
+                else:
+                    ranges.append([offset, offset + 1])
+    return [tuple(r) for r in ranges]
+
+def intersects(ranges, start, end):
+    # ranges as returned by changedRanges
+    i = bisect_right(ranges, (start, float("inf")))
+    if i > 0 and ranges[i - 1][1] > start:
+        return True
+    return i < len(ranges) and ranges[i][0] < end
+
+def subroutineEvents(datFile, offset, name):
+    # like FtData.subroutines[offset], without resolving every subroutine of the file
+    events = datFile.getEvents(offset)
+    if name == "goto":
+        for i, event in enumerate(events):
+            if event.name == "return":
+                return events[:i+1]
+    return events
+
+def diffEvents(oldEvents, newEvents):
+    # list of added/removed/changed events, index is the position in the old/new stream
+    changes = []
+    matcher = difflib.SequenceMatcher(None, [bytes(e.bytes) for e in oldEvents],
+        [bytes(e.bytes) for e in newEvents], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        paired = min(i2 - i1, j2 - j1) if tag == "replace" else 0
+        for k in range(paired):
+            oldEvent, newEvent = oldEvents[i1 + k], newEvents[j1 + k]
+            change = odict([("type", "changed"), ("oldIndex", i1 + k), ("newIndex", j1 + k)])
+            if oldEvent.commandId == newEvent.commandId:
+                change["name"] = newEvent.name
+                change["fields"] = odict((name, [oldEvent.fields.get(name), value])
+                    for name, value in newEvent.fields.items() if oldEvent.fields.get(name) != value)
+            change["old"] = oldEvent.toJsonDict()
+            change["new"] = newEvent.toJsonDict()
+            changes.append(change)
+        for k in range(i1 + paired, i2):
+            changes.append(odict([("type", "removed"), ("oldIndex", k), ("event", oldEvents[k].toJsonDict())]))
+        for k in range(j1 + paired, j2):
+            changes.append(odict([("type", "added"), ("newIndex", k), ("event", newEvents[k].toJsonDict())]))
+    return changes
+
+class DatDiff(object):
+    def __init__(self, oldFile, newFile):
+        self.old = oldFile if isinstance(oldFile, DatFile) else DatFile(oldFile)
+        self.new = newFile if isinstance(newFile, DatFile) else DatFile(newFile)
+        # the DatFiles created here are closed by close()
+        self.openedFiles = [datFile for datFile, file in ((self.old, oldFile), (self.new, newFile)) if datFile is not file]
+        # None if the data blocks have different sizes, then every stream is compared
+        self.ranges = None
+        if self.old.dataBlockSize == self.new.dataBlockSize:
+            self.ranges = changedRanges(self.old.data, self.new.data)
+        self.oldStreams = StreamScans(self.old)
+        self.newStreams = StreamScans(self.new)
+
+    def close(self):
+        for datFile in self.openedFiles:
+            datFile.close()
+        self.openedFiles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
+    def streamChanged(self, oldOffset, newOffset):
+        # returns True if the bytes of the event stream changed, only the streams are scanned
+        oldStart, oldEnd = self.oldStreams.extent(oldOffset)
+        if self.ranges is not None and oldOffset == newOffset:
+            if not intersects(self.ranges, oldStart, oldEnd):
+                return False
+        newStart, newEnd = self.newStreams.extent(newOffset)
+        return bytes(self.old.data[oldStart:oldEnd]) != bytes(self.new.data[newStart:newEnd])
+
+    def diffAttributes(self, oldFtData, newFtData):
+        changes = []
+        for i, (typeChar, name) in enumerate(attributesList):
+            # compared as bytes, so NaNs don't show up as changes
+            oldOffset = oldFtData.attributesOffset + i * 4
+            newOffset = newFtData.attributesOffset + i * 4
+            if self.ranges is not None and oldOffset == newOffset and not intersects(self.ranges, oldOffset, oldOffset + 4):
+                continue
+            if bytes(self.old.data[oldOffset:oldOffset+4]) != bytes(self.new.data[newOffset:newOffset+4]):
+                changes.append(odict([("name", name), ("old", oldFtData.attributes[i][1]),
+                    ("new", newFtData.attributes[i][1])]))
+        return changes
+
+    def diffSubaction(self, index, oldSubaction, newSubaction, streamChanged):
+        change = odict()
+        for name in subactionFields:
+            oldValue, newValue = getattr(oldSubaction, name), getattr(newSubaction, name)
+            if oldValue != newValue:
+                change[name] = [oldValue, newValue]
+        if oldSubaction.name != newSubaction.name:
+            change["name"] = [decodeString(oldSubaction.name), decodeString(newSubaction.name)]
+        if streamChanged:
+            change["events"] = diffEvents(oldSubaction.events, newSubaction.events)
+        if len(change) == 0:
+            return None
+        change["index"] = index
+        change["shortName"] = decodeString(newSubaction.shortName)
+        change.move_to_end("shortName", last=False)
+        change.move_to_end("index", last=False)
+        return change
+
+    def subactionEntryChanged(self, oldFtData, newFtData, index):
+        # the table entry or the name it points to
+        if self.ranges is None or oldFtData.subactionsOffset != newFtData.subactionsOffset:
+            return True
+        offset = oldFtData.subactionsOffset + index * 24
+        if intersects(self.ranges, offset, offset + 24):
+            return True
+        nameOffset = oldFtData.subactions[index].nameOffset
+        return intersects(self.ranges, nameOffset, nameOffset + len(oldFtData.subactions[index].name) + 1)
+
+    def diffFtData(self, oldFtData, newFtData):
+        result = odict()
+        result["attributes"] = self.diffAttributes(oldFtData, newFtData)
+
+        subactions = []
+        oldCount, newCount = len(oldFtData.subactions), len(newFtData.subactions)
+        for i in range(min(oldCount, newCount)):
+            oldSubaction, newSubaction = oldFtData.subactions[i], newFtData.subactions[i]
+            # unchanged entries still need their event stream checked
+            streamChanged = self.streamChanged(oldSubaction.eventsOffset, newSubaction.eventsOffset)
+            if not streamChanged and not self.subactionEntryChanged(oldFtData, newFtData, i):
+                continue
+            change = self.diffSubaction(i, oldSubaction, newSubaction, streamChanged)
+            if change:
+                subactions.append(change)
+        result["subactions"] = subactions
+        result["removedSubactions"] = list(range(newCount, oldCount))
+        result["addedSubactions"] = list(range(oldCount, newCount))
+
+        # subroutines are matched by offset
+        oldSubroutines = self.oldStreams.subroutines(oldFtData)
+        newSubroutines = self.newStreams.subroutines(newFtData)
+        subroutines = odict()
+        for offset in oldSubroutines:
+            if offset in newSubroutines and self.streamChanged(offset, offset):
+                subroutines[offset] = diffEvents(subroutineEvents(self.old, offset, oldSubroutines[offset]),
+                    subroutineEvents(self.new, offset, newSubroutines[offset]))
+        result["subroutines"] = subroutines
+        result["removedSubroutines"] = [offset for offset in oldSubroutines if offset not in newSubroutines]
+        result["addedSubroutines"] = [offset for offset in newSubroutines if offset not in oldSubroutines]
+        return result
+
+    def toJsonDict(self):
+        result = odict()
+        result["identical"] = bytes(self.old.fileData) == bytes(self.new.fileData)
+        if result["identical"]:
+            return result
+
+        result["header"] = odict((name, [getattr(self.old, name), getattr(self.new, name)])
+            for name in headerFields if getattr(self.old, name) != getattr(self.new, name))
+        if self.ranges is not None:
+            result["changedRanges"] = self.ranges
+
+        relocationTableChanged = bytes(self.old.fileData[self.old.relocationTableOffset:self.old.rootNodesOffset]) != \
+            bytes(self.new.fileData[self.new.relocationTableOffset:self.new.rootNodesOffset])
+        if relocationTableChanged:
+            oldPointers, newPointers = set(self.old.relocationTable), set(self.new.relocationTable)
+            result["relocationTable"] = odict([
+                ("added", sorted(newPointers - oldPointers)),
+                ("removed", sorted(oldPointers - newPointers)),
+            ])
+
+        oldNodes = odict((node.name, node) for node in self.old.rootNodes)
+        newNodes = odict((node.name, node) for node in self.new.rootNodes)
+        result["rootNodes"] = odict([
+            ("added", [decodeString(name) for name in newNodes if name not in oldNodes]),
+            ("removed", [decodeString(name) for name in oldNodes if name not in newNodes]),
+        ])
+
+        nodes = []
+        for name, oldNode in oldNodes.items():
+            newNode = newNodes.get(name)
+            if newNode is None or not isinstance(oldNode.data, FtData) or not isinstance(newNode.data, FtData):
+                continue
+            node = odict([("name", decodeString(name))])
+            node.update(self.diffFtData(oldNode.data, newNode.data))
+            nodes.append(node)
+        result["nodes"] = nodes
+        return result
+
+def diffMain(argv=None):
+    parser = argparse.ArgumentParser(prog="meleedat2json diff",
+        description="List the changes between two versions of a character .dat file as JSON")
+    parser.add_argument("old", help="The original .dat file")
+    parser.add_argument("new", help="The changed .dat file")
+    parser.add_argument("outfile", nargs="?", default=None, help="Path to output JSON file. Defaults to stdout.")
+    args = parser.parse_args(argv)
+
+    with DatDiff(args.old, args.new) as datDiff:
+        result = datDiff.toJsonDict()
+    if args.outfile:
+        with open(args.outfile, "w") as f:
+            json.dump(result, f, indent=4)
+    else:
+        json.dump(result, sys.stdout, indent=4)
+        sys.stdout.write("\n")
@@ -0,0 +1,141 @@
+import re
+import numpy as np
+
+from .meleedat2json import StreamScans
+from .events import eventTypes, hitboxFixedPointFields, postProcessHitboxEvent
+
+# Bulk decoding of event commands into NumPy structured arrays.
+# Instead of creating an Event object per command, all records of one command type are
+# gathered into a (count, length) byte matrix and every bitfield is extracted with
+# vectorized shifts and masks. The bit layouts are derived from the formats in eventTypes, or
+# the eventTypes of the schema of a DatFile (see schema.py).
+
+HITBOX = 0x2C
+THROW = 0x88
+
+# fixed point scaling, the same as in the postProcess functions of eventTypes
+fixedPointFields = {
+    postProcessHitboxEvent: hitboxFixedPointFields,
+}
+
+def scaledFields(eventType):
+    return fixedPointFields.get(eventType.postProcess, ())
+
+def parseBitLayout(fieldFormat, fieldNames):
+    # returns a list of (name, kind, bit offset, bit width)
+    layout = []
+    bitOffset = 0
+    names = iter(fieldNames)
+    for kind, width in re.findall(r"([a-zA-Z])(\d+)", fieldFormat):
+        width = int(width)
+        if kind in "uUsSbB":
+            assert width <= 32, "Fields wider than 32 bits are not supported"
+            layout.append((next(names), kind.lower(), bitOffset, width))
+        elif kind not in "pP":
+            raise ValueError("Unsupported bitstruct type '{}' in '{}'".format(kind, fieldFormat))
+        bitOffset += width
+    return layout
+
+def eventLayout(commandId, eventTypes=eventTypes):
+    eventType = eventTypes[commandId]
+    assert eventType.decoder, "Event type {} has no fields".format(hex(commandId))
+    fieldFormat = eventType.fields[0]
+    return parseBitLayout("p6" + fieldFormat.replace(" ", ""), eventType.fieldNames)
+
+def extractBits(records, bitOffset, width):
+    first = bitOffset // 8
+    last = (bitOffset + width - 1) // 8
+    values = np.zeros(records.shape[0], dtype=np.uint64)
+    for i in range(first, last + 1):
+        values = (values << np.uint64(8)) | records[:, i]
+    values >>= np.uint64((last + 1) * 8 - (bitOffset + width))
+    values &= np.uint64((1 << width) - 1)
+    return values
+
+def eventDtype(commandId, eventTypes=eventTypes):
+    dtype = [("offset", np.uint32)]
+    scaled = scaledFields(eventTypes[commandId])
+    for name, kind, bitOffset, width in eventLayout(commandId, eventTypes):
+        if name in scaled:
+            dtype.append((name, np.float64))
+        elif kind == "u":
+            dtype.append((name, np.uint32))
+        elif kind == "s":
+            dtype.append((name, np.int32))
+        else:
+            dtype.append((name, np.bool_))
+    return np.dtype(dtype)
+
+def gatherRecords(data, offsets, length):
+    buf = np.frombuffer(data, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    assert offsets.size == 0 or offsets.max() + length <= buf.size, "Event record out of bounds"
+    return buf[offsets[:, None] + np.arange(length)]
+
+def decodeEvents(data, offsets, commandId, eventTypes=eventTypes):
+    # offsets point to the start of each event (the command id byte) in data
+    length = eventTypes[commandId].length
+    records = gatherRecords(data, offsets, length)
+    table = np.zeros(len(offsets), dtype=eventDtype(commandId, eventTypes))
+    table["offset"] = offsets
+    scaled = scaledFields(eventTypes[commandId])
+    for name, kind, bitOffset, width in eventLayout(commandId, eventTypes):
+        values = extractBits(records, bitOffset, width)
+        if kind == "s":
+            values = values.astype(np.int64)
+            values -= (values >> (width - 1) & 1) << width
+        if name in scaled:
+            table[name] = values / 255
+        else:
+            table[name] = values
+    return table
+
+def collectEventOffsets(ftData, commandId):
+    # returns (source, offsets), source is the subaction index or -1 for subroutines.
+    # The streams are only scanned (see StreamScans) and the command ids of all events compared
+    # at once, the same events as in subaction.events and ftData.subroutines, without creating them.
+    datFile = ftData.datFile
+    scans = StreamScans(datFile)
+    eventTypes = datFile.schema.eventTypes
+    streams = [(i, subaction.eventsOffset, False) for i, subaction in enumerate(ftData.subactions)]
+    streams += [(-1, offset, name == "goto") for offset, name in scans.subroutines(ftData).items()]
+    sources = []
+    offsets = []
+    for source, offset, untilReturn in streams:
+        scan = scans.scan(offset)
+        if not scan.ok:
+            # left empty, like DatFile.getEvents does
+            for diagnostic in scan.diagnostics:
+                datFile.addDiagnostic(diagnostic)
+            continue
+        streamOffsets = scan.offsets
+        if untilReturn:
+            # goto targets end at the first return
+            for i, eventOffset in enumerate(streamOffsets):
+                eventType = eventTypes.get(datFile.data[eventOffset] & 0xFC)
+                if eventType is not None and eventType.name == "return":
+                    streamOffsets = streamOffsets[:i + 1]
+                    break
+        sources.append((source, len(streamOffsets)))
+        offsets += streamOffsets
+    offsets = np.array(offsets, dtype=np.int64)
+    sources = np.repeat(np.array([source for source, count in sources], dtype=np.int32),
+        [count for source, count in sources])
+    matches = np.frombuffer(datFile.data, dtype=np.uint8)[offsets] & 0xFC == commandId
+    return sources[matches], offsets[matches].astype(np.uint32)
+
+def eventTable(datFile, ftData, commandId):
+    sources, offsets = collectEventOffsets(ftData, commandId)
+    fields = decodeEvents(datFile.data, offsets, commandId, datFile.schema.eventTypes)
+    dtype = np.dtype([("subaction", np.int32)] + fields.dtype.descr)
+    table = np.zeros(len(offsets), dtype=dtype)
+    table["subaction"] = sources
+    for name in fields.dtype.names:
+        table[name] = fields[name]
+    return table
+
+def hitboxTable(datFile, ftData):
+    return eventTable(datFile, ftData, HITBOX)
+
+def throwTable(datFile, ftData):
+    return eventTable(datFile, ftData, THROW)
@@ -1,40 +1,64 @@
+import base64
 import struct
 import bitstruct
 from collections import OrderedDict as odict
 
+from .instrumentation import metrics
+
 class EventType(object):
     def __init__(self, length, name=None, fields=None):
         self.length = length
         self.name = name
         self.fields = fields
 
+        # compile the bitstruct format once, instead of for every decoded event
+        self.fieldNames = None
+        self.postProcess = None
+        self.decoder = None
+        if fields:
+            if len(fields) > 2:
+                fieldFormat, self.fieldNames, self.postProcess = fields
+            else:
+                fieldFormat, self.fieldNames = fields
+            # p6 to skip command id
+            fieldFormat = "p6" + fieldFormat.replace(" ", "")
+            self.decoder = bitstruct.compile(fieldFormat)
+            if self.decoder.calcsize() > self.length * 8:
+                raise ValueError("format: {} is longer than the event".format(fieldFormat))
+            valueCount = len(self.decoder.unpack(bytes(self.length)))
+            if valueCount != len(self.fieldNames):
+                raise ValueError("format: {} has {} values, fields: {}".format(fieldFormat, valueCount, self.fieldNames))
+        # bytes -> tuple of values, replaced by a generated function when a schema is compiled (see schema.py)
+        self.unpack = self.decoder.unpack if self.decoder else None
+
+hitboxElements = {
+    0x00: "normal",
+    0x01: "fire",
+    0x02: "electric",
+    0x03: "slash",
+    0x04: "coin",
+    0x05: "ice",
+    0x06: "sleep_103f",
+    0x07: "sleep_412f",
+    0x08: "grab", # https://gist.github.com/pfirsich/c5b4c467405ba88332cf1e243f4a2e4b
+    0x09: "grounded",
+    0x0A: "cape",
+    0x0B: "empty", # gray hitbox that doesn't hit
+    0x0C: "disabled",
+    0x0D: "darkness",
+    0x0E: "screwAttack",
+    0x0F: "poison/flower",
+    0x10: "nothing", # no graphic on hit
+}
+
+# size, x, y, z are fixed point floats
+hitboxFixedPointFields = ("size", "x", "y", "z")
+
 def postProcessHitboxEvent(fields):
-    # size, x, y, z are fixed point floats
-    fields["size"] /= 255
-    fields["x"] /= 255
-    fields["y"] /= 255
-    fields["z"] /= 255
-
-    elementMap = {
-        0x00: "normal",
-        0x01: "fire",
-        0x02: "electric",
-        0x03: "slash",
-        0x04: "coin",
-        0x05: "ice",
-        0x06: "sleep_103f",
-        0x07: "sleep_412f",
-        0x08: "grab", # https://gist.github.com/pfirsich/c5b4c467405ba88332cf1e243f4a2e4b
-        0x09: "grounded",
-        0x0A: "cape",
-        0x0B: "empty", # gray hitbox that doesn't hit
-        0x0C: "disabled",
-        0x0D: "darkness",
-        0x0E: "screwAttack",
-        0x0F: "poison/flower",
-        0x10: "nothing", # no graphic on hit
-    }
-    fields["element"] = elementMap.get(fields["element"], fields["element"])
+    for name in hitboxFixedPointFields:
+        fields[name] /= 255
+
+    fields["element"] = hitboxElements.get(fields["element"], fields["element"])
 
 # mostly from here: https://github.com/Adjective-Object/melee_subaction_unpacker/blob/1489f016240440d76c2a0e6bf94dfc71ea816c5d/melee.langdef
 # some info from here too: http://opensa.dantarion.com/wiki/Events_(Melee)
@@ -160,46 +184,160 @@ eventTypes = {
 }
 
 class Event(object):
-    def __init__(self, eventStr, offset):
+    # Events of a whole roster are kept in memory, so they only store the command id, the offset
+    # and a reference to the (shared) data. The bytes and fields are taken from the data on access.
+    __slots__ = ("commandId", "offset", "data", "type", "_fields")
+
+    # schema is an EventSchema (see schema.py), by default eventTypes is used
+    def __init__(self, eventStr, offset, schema=None):
+        types = schema.eventTypes if schema is not None else eventTypes
         self.commandId = eventStr[offset] & 0xFC
-        eventType = eventTypes.get(self.commandId, eventTypes["default"])
-        self.length = eventType.length
-        self.name = eventType.name
-        self.fields = odict()
-        self.bytes = eventStr[offset:offset+self.length]
-
-        if eventType.fields:
-            if len(eventType.fields) > 2:
-                fieldFormat, fieldNames, postProcess = eventType.fields
+        self.type = types.get(self.commandId, types["default"])
+        self.offset = offset
+        self.data = eventStr
+        self._fields = None
+
+    @property
+    def name(self):
+        return self.type.name
+
+    @property
+    def length(self):
+        return self.type.length
+
+    @property
+    def bytes(self):
+        return self.data[self.offset:self.offset+self.type.length]
+
+    @property
+    def fields(self):
+        # decoded on first access and kept, so changes to the dict stick like before
+        if self._fields is None:
+            if metrics.enabled:
+                with metrics.timer("decodeFields"):
+                    self._fields = self.decodeFields()
+                metrics.count("eventsDecoded")
             else:
-                fieldFormat, fieldNames = eventType.fields
-                postProcess = None
-            # p6 to skip command id
-            values = bitstruct.unpack("p6" + fieldFormat.replace(" ", ""), self.bytes)
-            assert len(values) == len(fieldNames), "format: {}, fields: {}, values: {}".format("p6" + fieldFormat, fieldNames, values)
-            for i in range(len(fieldNames)):
-                self.fields[fieldNames[i]] = values[i]
-
-            if postProcess:
-                postProcess(self.fields)
-
-    def toJsonDict(self):
+                self._fields = self.decodeFields()
+        return self._fields
+
+    def decodeFields(self):
+        fields = odict()
+        if self.type.unpack:
+            fields = odict(zip(self.type.fieldNames, self.type.unpack(self.bytes)))
+            if self.type.postProcess:
+                self.type.postProcess(fields)
+        return fields
+
+    # compact writes the command id as a number instead of a hex string
+    # bytesFormat is "hex", "base64" or None (no "bytes")
+    def toJsonDict(self, compact=False, bytesFormat="hex"):
         event_json = odict()
-        event_json["commandId"] = hex(self.commandId)
+        event_json["commandId"] = self.commandId if compact else hex(self.commandId)
         if self.name:
             event_json["name"] = self.name
         event_json["length"] = self.length
-        event_json["bytes"] = " ".join("{:02x}".format(byte) for byte in self.bytes)
+        if bytesFormat == "hex":
+            event_json["bytes"] = " ".join("{:02x}".format(byte) for byte in self.bytes)
+        elif bytesFormat == "base64":
+            event_json["bytes"] = base64.b64encode(self.bytes).decode("ascii")
         if len(self.fields) > 0:
             event_json["fields"] = self.fields
         return event_json
 
-def parseEvents(eventStr, offset):
-    events = []
-    while offset < len(eventStr):
-        event = Event(eventStr, offset)
-        events.append(event)
-        offset += event.length
-        if event.commandId == 0:
+# length of every command, indexed by commandId >> 2. Unknown commands get the default length.
+eventLengths = [eventTypes.get(i << 2, eventTypes["default"]).length for i in range(64)]
+knownCommands = [(i << 2) in eventTypes for i in range(64)]
+
+# Problems found while reading a file. Errors mean the data can't be read correctly, warnings
+# that it might not be (e.g. an unknown command, whose length is a guess).
+errorKinds = set(["outOfBounds", "truncated", "unterminated", "attributesTooSmall",
+    "subactionTableSize", "gotoWithoutReturn"])
+
+class Diagnostic(object):
+    def __init__(self, kind, offset, message):
+        self.kind = kind
+        self.offset = offset
+        self.message = message
+
+    @property
+    def isError(self):
+        return self.kind in errorKinds
+
+    def toJsonDict(self):
+        return odict([
+            ("kind", self.kind),
+            ("severity", "error" if self.isError else "warning"),
+            ("offset", self.offset),
+            ("message", self.message),
+        ])
+
+    def __repr__(self):
+        return "Diagnostic({}, {}, {})".format(self.kind, hex(self.offset), self.message)
+
+class MalformedDataError(ValueError):
+    def __init__(self, diagnostics):
+        self.diagnostics = diagnostics
+        ValueError.__init__(self, "; ".join("{} at {}: {}".format(d.kind, hex(d.offset), d.message)
+            for d in diagnostics))
+
+class StreamScan(object):
+    # result of scanEvents: offsets of the events, extent [start, end) and diagnostics
+    def __init__(self, start):
+        self.start = start
+        self.end = start
+        self.offsets = []
+        self.terminated = False
+        self.diagnostics = []
+
+    @property
+    def ok(self):
+        return not any(diagnostic.isError for diagnostic in self.diagnostics)
+
+# Length-only pass over an event stream (no Event objects, no field decoding)
+def scanEvents(eventStr, offset, maxEvents=None, schema=None):
+    lengths, known = (schema.eventLengths, schema.knownCommands) if schema is not None else (eventLengths, knownCommands)
+    scan = StreamScan(offset)
+    size = len(eventStr)
+    if offset >= size:
+        scan.diagnostics.append(Diagnostic("outOfBounds", offset,
+            "Event stream starts outside of the data block (size {})".format(hex(size))))
+        return scan
+
+    offsets = scan.offsets
+    while offset < size:
+        index = eventStr[offset] >> 2
+        if not known[index]:
+            scan.diagnostics.append(Diagnostic("unknownCommand", offset,
+                "Unknown command {}, assuming length {}".format(hex(index << 2), lengths[index])))
+        offsets.append(offset)
+        offset += lengths[index]
+        if index == 0:
+            scan.terminated = True
+            break
+        if maxEvents is not None and len(offsets) >= maxEvents:
             break
+    scan.end = offset
+
+    if offset > size:
+        scan.diagnostics.append(Diagnostic("truncated", offsets[-1],
+            "Last event ends at {}, after the end of the data block".format(hex(offset))))
+    if not scan.terminated:
+        scan.diagnostics.append(Diagnostic("unterminated", scan.start,
+            "Event stream does not end with exit after {} events".format(len(offsets))))
+    return scan
+
+# cache is an optional dict offset -> events, so every event stream is only decoded once
+# scan is the result of scanEvents for this stream, if it was scanned already
+def parseEvents(eventStr, offset, cache=None, scan=None, schema=None):
+    if cache is not None and offset in cache:
+        metrics.count("eventCacheHits")
+        return cache[offset]
+    if scan is None:
+        scan = scanEvents(eventStr, offset, schema=schema)
+    events = [Event(eventStr, eventOffset, schema) for eventOffset in scan.offsets]
+    if cache is not None:
+        cache[offset] = events
+    if metrics.enabled:
+        metrics.countEvents(events)
     return events
@@ -0,0 +1,82 @@
+from collections import OrderedDict as odict
+import contextlib
+import json
+import time
+
+# Timers and counters for the stages of the dump pipeline. Disabled by default, in which case
+# the hooks cost (almost) nothing. Usage:
+#   metrics.enable()
+#   with metrics.timer("stage"): ...
+#   metrics.count("thing", 3)
+#   metrics.summary()
+#
+# Timers can be nested. Besides the total duration, every timer has a self duration, which
+# excludes the time spent in nested timers, so the self durations of all timers don't overlap.
+
+class Metrics(object):
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        # name -> [total duration, self duration, calls]
+        self.timers = odict()
+        self.counters = odict()
+        # time spent in nested timers, for each running timer
+        self.nested = []
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    @contextlib.contextmanager
+    def _timer(self, name):
+        start = time.perf_counter()
+        self.nested.append(0.0)
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            timer = self.timers.setdefault(name, [0.0, 0.0, 0])
+            timer[0] += duration
+            timer[1] += duration - self.nested.pop()
+            timer[2] += 1
+            if len(self.nested) > 0:
+                self.nested[-1] += duration
+
+    def timer(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timer(name)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def countEvents(self, events):
+        # events created by parseEvents per command id, their fields are counted in
+        # "eventsDecoded" once they are decoded
+        self.count("eventsParsed", len(events))
+        for event in events:
+            self.count("eventsParsed.{}".format(hex(event.commandId)))
+
+    def summary(self):
+        return odict([
+            ("timers", odict((name, odict([("duration", duration), ("self", selfDuration), ("calls", calls)]))
+                for name, (duration, selfDuration, calls) in self.timers.items())),
+            ("counters", odict(sorted(self.counters.items()))),
+        ])
+
+    def report(self, f):
+        # human readable, "self" excludes the time of nested timers and "total" includes it
+        f.write("{:<28} {:>12} {:>12} {:>8}\n".format("stage", "self [ms]", "total [ms]", "calls"))
+        for name, (duration, selfDuration, calls) in self.timers.items():
+            f.write("{:<28} {:>12.2f} {:>12.2f} {:>8}\n".format(name, selfDuration * 1000, duration * 1000, calls))
+        f.write("{:<28} {:>12}\n".format("counter", "value"))
+        for name, value in sorted(self.counters.items()):
+            f.write("{:<28} {:>12}\n".format(name, value))
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
+
+metrics = Metrics()
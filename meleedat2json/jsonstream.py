@@ -0,0 +1,146 @@
+import json
+
+from .meleedat2json import DatFile, FtData, FtDataSubroutines, compactSchemaVersion
+from .instrumentation import metrics
+
+# Writes the JSON of DatFile.toJsonDict() incrementally, one subaction/subroutine/animation file
+# at a time, so the full dict tree is never held in memory. The output is byte-identical to
+# json.dump(dictData, f, indent=indent) (or separators=(",", ":") if compact).
+
+class JsonStreamWriter(object):
+    def __init__(self, f, indent=None, separators=None):
+        self.f = f
+        self.indent = " " * indent if isinstance(indent, int) else indent
+        if separators is None:
+            separators = (",", ": ") if indent is not None else (", ", ": ")
+        self.itemSeparator, self.keySeparator = separators
+        # one entry per open container: whether it has items yet
+        self.stack = []
+        # a key was written and its value has not
+        self.pendingKey = False
+
+    def newline(self, depth):
+        if self.indent is not None:
+            self.f.write("\n" + self.indent * depth)
+
+    def beginItem(self):
+        if len(self.stack) > 0:
+            if self.stack[-1]:
+                self.f.write(self.itemSeparator)
+            self.stack[-1] = True
+            self.newline(len(self.stack))
+
+    def beginValue(self):
+        # the value following a key is not a new item
+        if self.pendingKey:
+            self.pendingKey = False
+        else:
+            self.beginItem()
+
+    def key(self, key):
+        self.beginItem()
+        self.f.write(json.dumps(str(key)) + self.keySeparator)
+        self.pendingKey = True
+
+    def begin(self, bracket, key):
+        if key is not None:
+            self.key(key)
+        self.beginValue()
+        self.f.write(bracket)
+        self.stack.append(False)
+
+    def end(self, bracket):
+        if self.stack.pop():
+            self.newline(len(self.stack))
+        self.f.write(bracket)
+
+    def beginObject(self, key=None):
+        self.begin("{", key)
+
+    def endObject(self):
+        self.end("}")
+
+    def beginArray(self, key=None):
+        self.begin("[", key)
+
+    def endArray(self):
+        self.end("]")
+
+    def value(self, value, key=None):
+        if metrics.enabled:
+            with metrics.timer("json.dump"):
+                self.writeValue(value, key)
+        else:
+            self.writeValue(value, key)
+
+    def writeValue(self, value, key):
+        if key is not None:
+            self.key(key)
+        self.beginValue()
+        text = json.dumps(value, indent=self.indent, separators=(self.itemSeparator, self.keySeparator))
+        if self.indent is not None:
+            # JSON strings never contain raw newlines, so this only indents the structure
+            text = text.replace("\n", "\n" + self.indent * len(self.stack))
+        self.f.write(text)
+
+def writeFtDataJson(writer, ftData, animated, compact=False, bytesFormat="hex"):
+    # appends (ftData, subaction index) of the subactions with an animation file to animated.
+    # Subactions and subroutines are decoded without caching and dropped once written.
+    writer.beginObject("data")
+    writer.value(ftData.attributesOffset, "attributesOffset")
+    writer.value(DatFile.attributesJsonList(ftData), "attributes")
+    writer.value(ftData.subactionsOffset, "subactionsOffset")
+    writer.beginArray("subactions")
+    subroutines = FtDataSubroutines(ftData.datFile, (), cache=False)
+    for i, subaction in enumerate(ftData.iterSubactions(cache=False)):
+        animationFileIndex = None
+        if subaction.animationData is not None:
+            animationFileIndex = len(animated)
+            animated.append((ftData, i))
+        with metrics.timer("toJsonDict"):
+            subactionJson = DatFile.subactionJsonDict(subaction, animationFileIndex, compact, bytesFormat)
+        writer.value(subactionJson)
+        subroutines.addReferences(subaction)
+    writer.endArray()
+    writer.beginObject("subroutines")
+    for offset, subroutine in subroutines.followReferences():
+        with metrics.timer("toJsonDict"):
+            subroutineJson = [event.toJsonDict(compact, bytesFormat) for event in subroutine]
+        writer.value(subroutineJson, offset)
+    writer.endObject()
+    writer.endObject()
+
+def writeDatFileJson(datFile, f, indent=4, sourceFile=None, separators=None, compact=False, bytesFormat="hex"):
+    if compact:
+        indent = None
+        separators = (",", ":")
+    writer = JsonStreamWriter(f, indent, separators)
+    writer.beginObject()
+    if sourceFile is not None:
+        writer.value(sourceFile, "sourceFile")
+    if compact:
+        writer.value(compactSchemaVersion, "schemaVersion")
+
+    writer.beginArray("nodes")
+    animated = []
+    for node in datFile.rootNodes:
+        writer.beginObject()
+        for key, value in DatFile.nodeJsonDict(node).items():
+            writer.value(value, key)
+        if isinstance(node.data, FtData):
+            writeFtDataJson(writer, node.data, animated, compact, bytesFormat)
+        writer.endObject()
+    writer.endArray()
+
+    # the animation files are written after the nodes, like in toJsonDict. Each one is parsed,
+    # written and dropped.
+    if len(animated) > 0:
+        writer.beginArray("animationFiles")
+        for ftData, index in animated:
+            subaction = ftData.createSubaction(index)
+            with metrics.timer("toJsonDict"):
+                animationJson = subaction.animation.toJsonDict()
+            writer.value(animationJson)
+        writer.endArray()
+
+    writer.endObject()
@@ -1,19 +1,88 @@
-import argparse
 from collections import OrderedDict as odict
+from collections import deque
+from collections.abc import Mapping
+import contextlib
 import json
+import mmap
 import os
 import re
-import sys
 import struct
-import time
 
 # Sources:
 # https://smashboards.com/threads/melee-dat-format.292603/
 # http://opensa.dantarion.com/wiki/Moveset_File_Format_(Melee)
 # https://github.com/Adjective-Object/melee_subaction_unpacker
 
-from .events import parseEvents
-from .attributes import attributesList
+from .events import Event, parseEvents, scanEvents, Diagnostic, MalformedDataError
+from .pointers import PointerIndex
+from .schema import defaultSchema
+from .attributes import attributesList, attributesStruct, attributeIndices
+from .instrumentation import metrics
+
+def mapFile(path):
+    # the mapping stays valid after the file is closed
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def isPath(data):
+    return isinstance(data, (str, os.PathLike))
+
+def asView(data):
+    # data may be a path, bytes, bytearray, mmap or memoryview. Slices of the returned view
+    # share memory with data instead of copying it. Use openView for paths, so the mapping
+    # is closed again.
+    if isPath(data):
+        data = mapFile(data)
+        metrics.count("bytesMapped", len(data))
+    return memoryview(data).cast("B")
+
+def releaseView(view):
+    # returns False if the view is still exported (e.g. by a NumPy array)
+    try:
+        view.release()
+        return True
+    except BufferError:
+        return False
+
+def closeMapping(mapping):
+    # a mapping that still has views (e.g. slices kept by the caller) is closed once they are freed
+    try:
+        mapping.close()
+    except BufferError:
+        pass
+
+@contextlib.contextmanager
+def openView(data):
+    # asView as a context manager, which closes the mapping it created for a path on exit.
+    # None is passed through.
+    view = asView(data) if data is not None else None
+    mapping = view.obj if isPath(data) else None
+    try:
+        yield view
+    finally:
+        if mapping is not None:
+            releaseView(view)
+            closeMapping(mapping)
+
+def readCString(view, offset):
+    # search in small chunks, so we don't copy the whole buffer to find the terminator
+    chunkSize = 64
+    end = offset
+    while True:
+        chunk = bytes(view[end:end+chunkSize])
+        if len(chunk) == 0:
+            raise ValueError("Unterminated string at offset {}".format(offset))
+        terminator = chunk.find(b'\0')
+        if terminator >= 0:
+            return bytes(view[offset:end+terminator])
+        end += len(chunk)
+
+attributeNames = [name for typeChar, name in attributesList]
+
+def decodeString(string):
+    # names in modded or damaged files aren't always valid utf-8, they are reported in
+    # DatFile.diagnostics when read
+    return string.decode("utf-8", errors="replace")
 
 def figatreeShortname(name):
     m = re.match(b".*ACTION_(.*?)_figatree", name)
@@ -22,7 +91,43 @@ def figatreeShortname(name):
     else:
         return name
 
+class LazyList(object):
+    # A read-only list of count items, which are created with create(index) on first access
+    def __init__(self, count, create):
+        self._items = [None] * count
+        self._create = create
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self._items)
+        if not 0 <= index < len(self._items):
+            raise IndexError("LazyList index out of range")
+        item = self._items[index]
+        if item is None:
+            item = self._create(index)
+            self._items[index] = item
+        return item
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def loaded(self):
+        # the items that were created, without creating the others
+        return [item for item in self._items if item is not None]
+
 class FtDataSubaction(object):
+    # Only the subaction table entry is read on construction. The name, events and animation
+    # are decoded the first time they are accessed.
+    # __weakref__ because timeline.py keeps its results in a WeakKeyDictionary
+    __slots__ = ("nameOffset", "animationOffset", "animationSize", "eventsOffset", "posFlags",
+        "characterId", "datFile", "_name", "_shortName", "_events", "_animation", "__weakref__")
+
     def __init__(self, datFile, offset):
         values = struct.unpack_from(">4IHHI", datFile.data, offset)
         self.nameOffset = values[0]
@@ -33,22 +138,199 @@ class FtDataSubaction(object):
         self.characterId = values[5]
         # last 4 bytes are always 00000000; game inserts pointer here to animation in ARAM
 
-        self.name = datFile.getDataString(self.nameOffset)
-        self.shortName = figatreeShortname(self.name)
-
-        self.events = parseEvents(datFile.data, self.eventsOffset)
-
-        if datFile.animFileData and self.animationSize > 0:
-            # this is just for caching, because we might write exactly this buffer later
-            self.animationData = datFile.animFileData[self.animationOffset:self.animationOffset+self.animationSize]
-            self.animation = DatFile(self.animationData)
+        self.datFile = datFile
+        self._name = None
+        self._shortName = None
+        self._events = None
+        self._animation = None
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = self.datFile.getDataString(self.nameOffset)
+        return self._name
+
+    @property
+    def shortName(self):
+        if self._shortName is None:
+            self._shortName = figatreeShortname(self.name)
+        return self._shortName
+
+    @property
+    def events(self):
+        if self._events is None:
+            self._events = self.datFile.getEvents(self.eventsOffset)
+        return self._events
+
+    def unload(self):
+        # drops the events and the animation, they are decoded again on the next access
+        self._events = None
+        self._animation = None
+
+    @property
+    def animationData(self):
+        if self.datFile.animFileData and self.animationSize > 0:
+            # animFileData is a memoryview, so this does not copy
+            return self.datFile.animFileData[self.animationOffset:self.animationOffset+self.animationSize]
         else:
-            self.animation = None
+            return None
+
+    @property
+    def animation(self):
+        if self._animation is None:
+            animationData = self.animationData
+            if animationData is None:
+                return None
+            animationStore = self.datFile.animationStore
+            if animationStore is not None:
+                self._animation = animationStore.getAnimation(self.datFile.animFileKey,
+                    self.animationOffset, self.animationSize)
+            else:
+                with metrics.timer("animationDatFile"):
+                    self._animation = DatFile(animationData)
+                metrics.count("animationFilesParsed")
+        return self._animation
+
+class FtDataSubroutines(Mapping):
+    # Maps event offsets to the events of every subroutine/goto target reachable from a subaction.
+    # The subactions are only scanned for references when the mapping is first used and each
+    # subroutine is parsed when it is first accessed. Event lists are shared with the event cache
+    # of the DatFile, so nothing is decoded twice.
+    # With cache=False nothing is kept and the references are added with addReferences as the
+    # subactions are processed, then followReferences yields every subroutine once (see jsonstream.py).
+    def __init__(self, datFile, subactions, cache=True):
+        self.datFile = datFile
+        self.subactions = subactions
+        self.cache = cache
+        self._references = None
+        self._subroutines = {}
+
+    @staticmethod
+    def referencedOffset(event):
+        if event.name == "subroutine" or event.name == "goto":
+            return int(event.fields["location"])
+        return None
+
+    def addReferences(self, subaction):
+        if self._references is None:
+            self._references = {}
+        for event in subaction.events:
+            offset = self.referencedOffset(event)
+            if offset is not None:
+                self._references[offset] = (event.name, subaction)
+
+    def followReferences(self):
+        # follow subroutines/gotos inside subroutines transitively. Yields (offset, subroutine)
+        # in the order of references, so every subroutine is only resolved once without the cache.
+        if self._references is None:
+            self._references = {}
+        worklist = deque(self._references)
+        while len(worklist) > 0:
+            offset = worklist.popleft()
+            subaction = self._references[offset][1]
+            subroutine = self[offset]
+            for event in subroutine:
+                target = self.referencedOffset(event)
+                if target is not None and target not in self._references:
+                    self._references[target] = (event.name, subaction)
+                    worklist.append(target)
+            yield offset, subroutine
+
+    @property
+    def references(self):
+        # offset -> (event name, subaction the reference was found from)
+        if self._references is None:
+            self._references = {}
+            for subaction in self.subactions:
+                self.addReferences(subaction)
+            for offset, subroutine in self.followReferences():
+                pass
+        return self._references
+
+    def __getitem__(self, offset):
+        if offset not in self._subroutines:
+            eventName, subaction = self.references[offset]
+            subroutine = self.datFile.getEvents(offset, self.cache)
+            metrics.count("subroutinesResolved")
+
+            # truncate the goto subroutine at the first "return", otherwise we might have some
+            # subroutine-parts in the JSON multiple times
+            if eventName == "goto":
+                firstReturn = None
+                for i, subEvent in enumerate(subroutine):
+                    if subEvent.name == "return":
+                        firstReturn = i
+                        break
+
+                if firstReturn is None:
+                    self.datFile.addDiagnostic(Diagnostic("gotoWithoutReturn", offset,
+                        "'goto {}' from {} did not end in return!".format(offset, subaction.name)))
+                else:
+                    subroutine = subroutine[:firstReturn+1] # +1 to include the return
+
+            if not self.cache:
+                return subroutine
+            self._subroutines[offset] = subroutine
+        return self._subroutines[offset]
+
+    def __iter__(self):
+        return iter(self.references)
+
+    def __len__(self):
+        return len(self.references)
+
+class StreamScans(object):
+    # Extents and subroutine/goto references of the event streams of a DatFile, from length-only
+    # scans (see events.scanEvents), so streams are looked at without parsing them into Events.
+    # Used by datdiff.py (unchanged streams) and eventcolumns.py (bulk decoding).
+    def __init__(self, datFile):
+        self.datFile = datFile
+        self.scans = {}
+
+    def scan(self, offset):
+        if offset not in self.scans:
+            self.scans[offset] = scanEvents(self.datFile.data, offset, schema=self.datFile.schema)
+        return self.scans[offset]
+
+    def extent(self, offset):
+        scan = self.scan(offset)
+        return scan.start, min(scan.end, len(self.datFile.data))
+
+    def references(self, offset, untilReturn=False):
+        # (target, event name) of the subroutines/gotos in the stream. Only those events are
+        # decoded. untilReturn stops at the first return, like goto targets are cut there.
+        references = []
+        eventTypes = self.datFile.schema.eventTypes
+        for eventOffset in self.scan(offset).offsets:
+            eventType = eventTypes.get(self.datFile.data[eventOffset] & 0xFC)
+            if eventType is None:
+                continue
+            if eventType.name == "subroutine" or eventType.name == "goto":
+                target = FtDataSubroutines.referencedOffset(Event(self.datFile.data, eventOffset, self.datFile.schema))
+                references.append((target, eventType.name))
+            elif untilReturn and eventType.name == "return":
+                break
+        return references
+
+    def subroutines(self, ftData):
+        # offset -> event name of the reference, in the order of FtData.subroutines
+        subroutines = {}
+        for i in range(len(ftData.subactions)):
+            for target, name in self.references(ftData.subactions[i].eventsOffset):
+                subroutines[target] = name
+        worklist = deque(subroutines)
+        while len(worklist) > 0:
+            offset = worklist.popleft()
+            for target, name in self.references(offset, subroutines[offset] == "goto"):
+                if target not in subroutines:
+                    subroutines[target] = name
+                    worklist.append(target)
+        return subroutines
 
 class FtData(object):
     def __init__(self, datFile, offset):
         # header
-        values = struct.unpack_from(">6I", datFile.data, offset)
+        values = datFile.unpackHeader(">6I", datFile.data, offset, "FtData header")
         self.attributesOffset = values[0]
         self.attributesEnd = values[1]
         self.unknown1 = values[2]
@@ -56,49 +338,57 @@ class FtData(object):
         self.unknown2 = values[4]
         self.subactionsEnd = values[5]
 
-        # load attributes
+        # load attributes. A block that is too small or outside of the data is not read, all
+        # values are None then.
         attributeDataSize = self.attributesEnd - self.attributesOffset
-        fmt = ">"
-        for attr in attributesList:
-            fmt += attr[0]
-        assert attributeDataSize >= struct.calcsize(fmt) # usually ==, but > for Kirby and Peach
-        values = struct.unpack_from(fmt, datFile.data, self.attributesOffset)
-
-        self.attributes = []
-        for i, attr in enumerate(attributesList):
-            self.attributes.append((attr[1], values[i]))
+        if attributeDataSize < attributesStruct.size: # usually ==, but > for Kirby and Peach
+            datFile.addDiagnostic(Diagnostic("attributesTooSmall", self.attributesOffset,
+                "Attributes are {} bytes, expected at least {}".format(attributeDataSize, attributesStruct.size)))
+            self.attributeValues = (None,) * len(attributeNames)
+        elif self.attributesOffset + attributesStruct.size > len(datFile.data):
+            datFile.addDiagnostic(Diagnostic("outOfBounds", self.attributesOffset,
+                "Attributes end after the end of the data block"))
+            self.attributeValues = (None,) * len(attributeNames)
+        else:
+            # in the order of attributesList, use attribute(name) to look one up by name
+            self.attributeValues = attributesStruct.unpack_from(datFile.data, self.attributesOffset)
+        self.attributes = list(zip(attributeNames, self.attributeValues))
 
-        # load subactions
+        # subactions and subroutines are parsed lazily
         subactionDataSize = self.subactionsEnd - self.subactionsOffset
-        subactionCount = subactionDataSize // 24
-        assert subactionCount * 24 == subactionDataSize
-        self.subactions = []
-        self.subroutines = {}
-        for i in range(subactionCount):
-            start = self.subactionsOffset + i * 24
-            subaction = FtDataSubaction(datFile, start)
-            self.subactions.append(subaction)
-
-            # we might end up parsing some evnets multiple times here, be we don't care
-            for event in subaction.events:
-                if event.name == "subroutine" or event.name == "goto":
-                    offset = int(event.fields["location"])
-                    subroutine = parseEvents(datFile.data, offset)
-
-                    # truncate the goto subroutine at the first "return", otherwise we might have some
-                    # subroutine-parts in the JSON multiple times
-
-                    if event.name == "goto":
-                        firstReturn = None
-                        for i, subEvent in enumerate(subroutine):
-                            if subEvent.name == "return":
-                                firstReturn = i
-                                break
-
-                        assert firstReturn, "'goto {}' from {} did not end in return!".format(offset, subaction.name)
-                        subroutine = subroutine[:firstReturn+1] # +1 to include the return
-
-                    self.subroutines[offset] = subroutine
+        subactionCount = max(subactionDataSize // 24, 0)
+        if subactionCount * 24 != subactionDataSize:
+            datFile.addDiagnostic(Diagnostic("subactionTableSize", self.subactionsOffset,
+                "Subaction table size {} is not a multiple of 24".format(subactionDataSize)))
+        if subactionCount > 0 and self.subactionsOffset + subactionCount * 24 > len(datFile.data):
+            # only the entries inside of the data are read
+            datFile.addDiagnostic(Diagnostic("outOfBounds", self.subactionsOffset,
+                "Subaction table ends after the end of the data block"))
+            subactionCount = max((len(datFile.data) - self.subactionsOffset) // 24, 0)
+        self.datFile = datFile
+        self.subactions = LazyList(subactionCount, self.createSubaction)
+        self.subroutines = FtDataSubroutines(datFile, self.subactions)
+
+    def createSubaction(self, index):
+        # a new FtDataSubaction, use subactions[index] for the shared one
+        return FtDataSubaction(self.datFile, self.subactionsOffset + index * 24)
+
+    def iterSubactions(self, cache=True):
+        # With cache=False the subactions are created for the iteration only, their events are
+        # not added to the event cache and are dropped (with the animation) once the next
+        # subaction is requested, so only one subaction is decoded at a time.
+        for i in range(len(self.subactions)):
+            if cache:
+                yield self.subactions[i]
+            else:
+                subaction = self.createSubaction(i)
+                subaction._events = self.datFile.getEvents(subaction.eventsOffset, cache=False)
+                yield subaction
+                subaction.unload()
+
+    def attribute(self, name):
+        # KeyError for unknown or ambiguous names ("?"), those are only available by index
+        return self.attributeValues[attributeIndices[name]]
 
 # https://smashboards.com/threads/melee-dat-format.292603/page-6#post-20386112
 # https://smashboards.com/threads/melee-animation-model-workshop.433432/
@@ -117,7 +407,7 @@ class FigaTree(object):
 class RootNode(object):
     def __init__(self, datFile, offset):
         # offset is a offset in fileData!
-        values = struct.unpack_from(">2I", datFile.fileData, offset)
+        values = datFile.unpackHeader(">2I", datFile.fileData, offset, "Root node")
         self.rootOffset = values[0]
         self.stringTableOffset = values[1]
         self.name = datFile.getString(self.stringTableOffset)
@@ -133,10 +423,38 @@ class RootNode(object):
         else:
             print("Warning! Unkown/Unimplemented node type:", self.name)
 
+# Version of the --compact output format, which is written as "schemaVersion"
+compactSchemaVersion = 1
+
 class DatFile(object):
-    def __init__(self, fileData, animFileData=None):
+    # fileData and animFileData may be paths (which are memory mapped), bytes, mmaps or memoryviews.
+    # Everything is read through memoryviews, so data, animation blobs and event bytes are not copied.
+    # With an animationStore (see animstore.py) the AJ file and its parsed animations are shared
+    # with other DatFiles using the same store.
+    # Problems with the data are collected in diagnostics. Event streams with errors are left empty,
+    # attribute blocks that can't be read are all None and strings that can't be read are empty.
+    # Damaged headers and tables (which the rest is found with) always raise a MalformedDataError. With strict, the first error raises a
+    # MalformedDataError instead, before the fields of a bad event stream are decoded.
+    # schema is the EventSchema used to decode events (see schema.py), by default the default schema.
+    # Files DatFile maps itself are closed with close() or at the end of a with block.
+    def __init__(self, fileData, animFileData=None, animationStore=None, strict=False, schema=None):
+        # mappings of the files that were passed as paths
+        self.mappings = []
+        fileData = self.openData(fileData)
+        self.schema = schema if schema is not None else defaultSchema
+        self.schema.compile()
+        self.strict = strict
+        self.diagnostics = []
+        self.animationStore = animationStore
+        self.animFileKey = None
+        if animFileData is not None:
+            if animationStore is not None:
+                self.animFileKey, animFileData = animationStore.openAnimFile(animFileData)
+            else:
+                animFileData = self.openData(animFileData)
+
         # header
-        values = struct.unpack_from('>8I', fileData, 0)
+        values = self.unpackHeader('>8I', fileData, 0, "File header")
         self.fileSize = values[0]
         self.dataBlockSize = values[1]
         self.relocationTableCount = values[2]
@@ -156,11 +474,17 @@ class DatFile(object):
         self.fileData = fileData
         self.data = fileData[self.dataBlockOffset:self.dataBlockOffset + self.dataBlockSize]
         self.animFileData = animFileData
+        # event offset -> list of events, shared by subactions and subroutines
+        self.eventCache = {}
+        # (kind, offset) of the diagnostics that were added, streams can be scanned again and
+        # also start inside other streams
+        self.reportedDiagnostics = set()
+        self._pointerIndex = None
 
         # load relocation table
-        self.relocationTable = list(struct.unpack_from(
+        self.relocationTable = list(self.unpackHeader(
             ">{}I".format(self.relocationTableCount),
-            fileData, self.relocationTableOffset))
+            fileData, self.relocationTableOffset, "Relocation table"))
 
         # load root nodes
         self.rootNodes = []
@@ -169,131 +493,239 @@ class DatFile(object):
             node = RootNode(self, self.rootNodesOffset + 0x08 * i)
             self.rootNodes.append(node)
 
+    def unpackHeader(self, fmt, view, offset, what):
+        # the tables the rest of the file is found with, damaged ones raise even if not strict
+        try:
+            return struct.unpack_from(fmt, view, offset)
+        except struct.error:
+            diagnostic = Diagnostic("outOfBounds", offset, "{} runs past the end of the data".format(what))
+            self.diagnostics.append(diagnostic)
+            raise MalformedDataError([diagnostic]) from None
+
+    def openData(self, data):
+        view = asView(data)
+        if isPath(data):
+            self.mappings.append(view.obj)
+        return view
+
+    def close(self):
+        # Closes the files that were passed as paths. The DatFile, its events and animations
+        # can't be used afterwards.
+        if self.animationStore is None:
+            for node in self.rootNodes:
+                if isinstance(node.data, FtData):
+                    for subaction in node.data.subactions.loaded():
+                        if subaction._animation is not None:
+                            subaction._animation.close()
+        self.eventCache = {}
+        releaseView(self.data)
+        releaseView(self.fileData)
+        if self.animFileData is not None and self.animationStore is None:
+            releaseView(self.animFileData)
+        for mapping in self.mappings:
+            closeMapping(mapping)
+        self.mappings = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
+
     def getString(self, offset):
-        start = self.stringTableOffset + offset
-        end = self.fileData.index(b'\0', start)
-        return self.fileData[start:end]
+        # offset in the string table, the diagnostic offset is relative to the data block like the others
+        return self.readString(self.fileData, self.stringTableOffset + offset,
+            self.stringTableOffset + offset - self.dataBlockOffset)
+
+    def readString(self, view, offset, diagnosticOffset):
+        # unterminated strings are empty and invalid utf-8 is kept, both are reported in diagnostics
+        try:
+            string = readCString(view, offset)
+        except ValueError:
+            self.addDiagnostic(Diagnostic("outOfBounds", diagnosticOffset, "String runs past the end of the data"))
+            return b""
+        try:
+            string.decode("utf-8")
+        except UnicodeDecodeError as e:
+            self.addDiagnostic(Diagnostic("invalidString", diagnosticOffset, "String is not valid utf-8: {}".format(e.reason)))
+        return string
+
+    def addDiagnostic(self, diagnostic):
+        key = (diagnostic.kind, diagnostic.offset)
+        if key in self.reportedDiagnostics:
+            return
+        self.reportedDiagnostics.add(key)
+        self.diagnostics.append(diagnostic)
+        if self.strict and diagnostic.isError:
+            raise MalformedDataError([diagnostic])
+
+    def getEvents(self, offset, cache=True):
+        # with cache=False, the events are only taken from the cache, not added to it
+        with metrics.timer("parseEvents"):
+            return self._getEvents(offset, cache)
+
+    def _getEvents(self, offset, cache):
+        scan = None
+        if offset not in self.eventCache:
+            scan = scanEvents(self.data, offset, schema=self.schema)
+            for diagnostic in scan.diagnostics:
+                self.addDiagnostic(diagnostic)
+            if not scan.ok:
+                # streams with errors (e.g. running past the data) are not decoded, they are
+                # only reported in diagnostics
+                metrics.count("streamsSkipped")
+                if cache:
+                    self.eventCache[offset] = []
+                return []
+            if not cache:
+                return parseEvents(self.data, offset, None, scan, self.schema)
+        return parseEvents(self.data, offset, self.eventCache, scan, self.schema)
+
+    def validate(self):
+        # scans every event stream, only decoding the targets of subroutines/gotos, and
+        # returns the diagnostics
+        for node in self.rootNodes:
+            if isinstance(node.data, FtData):
+                for subaction in node.data.subactions:
+                    subaction.events
+                for offset in node.data.subroutines:
+                    node.data.subroutines[offset]
+        return self.diagnostics
 
     def getDataString(self, offset):
-        end = self.data.index(b'\0', offset)
-        return self.data[offset:end]
-
-    def toJsonDict(self):
+        return self.readString(self.data, offset, offset)
+
+    @property
+    def pointerIndex(self):
+        # built from the relocation table on first use, see pointers.py
+        if self._pointerIndex is None:
+            self._pointerIndex = PointerIndex(self.data, self.relocationTable,
+                [node.rootOffset for node in self.rootNodes])
+        return self._pointerIndex
+
+    def referencesTo(self, offset):
+        # offsets of the pointers in the data block that point to offset
+        return self.pointerIndex.referencesTo(offset)
+
+    def regionOf(self, offset):
+        # (start, end) of the data between the pointer targets around offset
+        return self.pointerIndex.regionOf(offset)
+
+    def unreachableRegions(self):
+        # regions that can't be reached from the root nodes by following pointers
+        return self.pointerIndex.unreachableRegions([node.rootOffset for node in self.rootNodes])
+
+    # The *JsonDict helpers build the parts of toJsonDict, so they can also be written piece by
+    # piece by jsonstream.writeDatFileJson
+
+    @staticmethod
+    def nodeJsonDict(node):
+        # without "data" for FtData nodes
+        node_json = odict([
+            ("name", decodeString(node.name)),
+            ("rootOffset", node.rootOffset)
+        ])
+        if isinstance(node.data, FigaTree):
+            node_json["shortName"] = decodeString(node.shortName)
+            node_json.move_to_end("shortName", last=False)
+            node_json["data"] = odict([
+                ("numFrames", node.data.numFrames),
+                ("boneTableOffset", node.data.boneTableOffset),
+                ("animDataOffset", node.data.animDataOffset),
+            ])
+        return node_json
+
+    @staticmethod
+    def attributesJsonList(ftData):
+        attributes_json = []
+        for attr in ftData.attributes:
+            attributes_json.append(odict([
+                ("name", attr[0]),
+                ("value", attr[1]),
+            ]))
+        return attributes_json
+
+    @staticmethod
+    def subactionJsonDict(subaction, animationFileIndex=None, compact=False, bytesFormat="hex"):
+        subaction_json = odict([
+            ("shortName", decodeString(subaction.shortName)),
+            ("name", decodeString(subaction.name)),
+            ("animOffset", subaction.animationOffset),
+            ("animSize", subaction.animationSize),
+        ])
+        if animationFileIndex is not None:
+            subaction_json["animationFile"] = animationFileIndex
+        subaction_json["eventsOffset"] = subaction.eventsOffset
+        subaction_json["events"] = [event.toJsonDict(compact, bytesFormat) for event in subaction.events]
+        return subaction_json
+
+    # compact and bytesFormat are passed to Event.toJsonDict. Compact output also includes
+    # the schemaVersion.
+    def toJsonDict(self, compact=False, bytesFormat="hex"):
         file_json = odict()
+        if compact:
+            file_json["schemaVersion"] = compactSchemaVersion
         file_json["nodes"] = []
         for node in self.rootNodes:
-            node_json = odict([
-                ("name", node.name.decode("utf-8")),
-                ("rootOffset", node.rootOffset)
-            ])
+            node_json = self.nodeJsonDict(node)
             if isinstance(node.data, FtData):
-                attributes_json = []
-                for attr in node.data.attributes:
-                    attributes_json.append(odict([
-                        ("name", attr[0]),
-                        ("value", attr[1]),
-                    ]))
-
                 subactions_json = []
                 for i, subaction in enumerate(node.data.subactions):
-                    subaction_json = odict([
-                        ("shortName", subaction.shortName.decode("utf-8")),
-                        ("name", subaction.name.decode("utf-8")),
-                        ("animOffset", subaction.animationOffset),
-                        ("animSize", subaction.animationSize),
-                    ])
-
+                    animationFileIndex = None
                     if subaction.animation:
                         if not "animationFiles" in file_json:
                             file_json["animationFiles"] = []
-                        subaction_json["animationFile"] = len(file_json["animationFiles"])
+                        animationFileIndex = len(file_json["animationFiles"])
                         file_json["animationFiles"].append(subaction.animation.toJsonDict())
 
-                    subaction_json["eventsOffset"] = subaction.eventsOffset
-                    subaction_json["events"] = []
-                    for event in subaction.events:
-                        subaction_json["events"].append(event.toJsonDict())
-
-                    subactions_json.append(subaction_json)
+                    subactions_json.append(self.subactionJsonDict(subaction, animationFileIndex, compact, bytesFormat))
 
                 subroutines_json = odict()
                 for offset, subroutine in node.data.subroutines.items():
-                    subroutines_json[offset] = []
-                    for event in subroutine:
-                        subroutines_json[offset].append(event.toJsonDict())
+                    subroutines_json[offset] = [event.toJsonDict(compact, bytesFormat) for event in subroutine]
 
                 node_json["data"] = odict([
                     ("attributesOffset", node.data.attributesOffset),
-                    ("attributes", attributes_json),
+                    ("attributes", self.attributesJsonList(node.data)),
                     ("subactionsOffset", node.data.subactionsOffset),
                     ("subactions", subactions_json),
                     ("subroutines", subroutines_json),
                 ])
-            elif isinstance(node.data, FigaTree):
-                node_json["shortName"] = node.shortName.decode("utf-8")
-                node_json.move_to_end("shortName", last=False)
-                node_json["data"] = odict([
-                    ("numFrames", node.data.numFrames),
-                    ("boneTableOffset", node.data.boneTableOffset),
-                    ("animDataOffset", node.data.animDataOffset),
-                ])
 
             file_json["nodes"].append(node_json)
         return file_json
 
-def main():
-    parser = argparse.ArgumentParser(description='Dump Melee .dat files to JSON')
-    parser.add_argument('datfile', help='The .dat file')
-    parser.add_argument("outfile", help="Path to output JSON file.")
-    parser.add_argument("-a", "--animfile", default=None, help="Path to the corresponding animation file. If nothing is given an Pl**AJ.dat file will be looked for next to the PJ**.dat (the input)")
-    parser.add_argument("--dumpanims", default=False, action="store_true", help="Dumps animation files from the Pl**AJ.dat to separate files (per subaction)")
-    parser.add_argument("--animpath", default="animationFiles", help="Directory to where the animations from Pl**AJ.dat should be dumped to.")
-    parser.add_argument("--time", default=False, action="store_true", help="Times how long the dumping took. Mainly for optimization.")
-    args = parser.parse_args()
-
-    startTime = time.time()
-
-    with open(args.datfile, "rb") as f:
-        fileData = f.read()
+def getAnimFilePath(datFilePath):
+    # Pl**AJ.dat next to the Pl**.dat
+    return os.path.splitext(datFilePath)[0] + "AJ.dat"
 
-    if args.animfile:
-        ajFilePath = args.animfile
-    else:
-        ajFilePath = os.path.splitext(args.datfile)[0] + "AJ.dat"
-
-    if os.path.isfile(ajFilePath):
-        with open(ajFilePath, "rb") as f:
-            animFileData = f.read()
-    else:
-        print("Pl**AJ.dat file not found in '{}'".format(ajFilePath))
-        print("You can pass --animfile to pass the path to the AJ file directly")
-        animFileData = None
-
-    file = DatFile(fileData, animFileData)
-
-    # Dump Anims
-    if args.dumpanims:
-        assert animFileData
-        assert file.rootNodes[0].name.startswith(b"ftData")
-        os.makedirs(args.animpath, exist_ok=True)
-        for i, subact in enumerate(file.rootNodes[0].data.subactions):
-            name = str(i)
-            if len(subact.name) > 0:
-                name += " - " + subact.shortName.decode("utf-8")
-            with open(os.path.join(args.animpath, "{}.dat".format(name)), "wb") as f:
-                if subact.animationSize > 0:
-                    f.write(subact.animationData)
-
-    # Save to JSON
-    print("Saving to {}..".format(args.outfile))
-    with open(args.outfile, "w") as f:
-        dictData = file.toJsonDict()
-        dictData["sourceFile"] = os.path.basename(args.datfile)
+def dumpJson(dictData, sourceFile, f, compact=False):
+    # dictData is the result of DatFile.toJsonDict(), sourceFile may be None
+    if sourceFile is not None:
+        dictData["sourceFile"] = os.path.basename(sourceFile)
         dictData.move_to_end("sourceFile", last=False)
+    if compact:
+        json.dump(dictData, f, separators=(",", ":"))
+    else:
         json.dump(dictData, f, indent=4)
 
-    if args.time:
-        print("Duration: {}s".format(time.time() - startTime))
+def defaultBytesFormat(compact):
+    return None if compact else "hex"
+
+def getBytesFormat(bytesArg, compact):
+    # bytesArg is the value of --bytes (see cli.addOutputArguments)
+    if bytesArg is None:
+        return defaultBytesFormat(compact)
+    return None if bytesArg == "none" else bytesArg
+
+# The command line interface lives in cli.py. It is only imported when main is accessed,
+# so using the parser as a library does not import argparse.
+def __getattr__(name):
+    if name == "main":
+        from .cli import main
+        return main
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
 
 if __name__ == "__main__":
+    from .cli import main
     main()
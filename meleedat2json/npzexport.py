@@ -0,0 +1,114 @@
+import os
+import numpy as np
+
+from .meleedat2json import decodeString
+from .eventcolumns import decodeEvents
+
+# Flattens FtData into NumPy tables, so downstream tools can load (or memory map) them
+# without decoding any JSON:
+#   subactions: one row per subaction
+#   events: one row per event of every subaction and subroutine
+#   fields_<commandId>: decoded fields of every event with that command id, "event" is the row in events
+#   strings, stringOffsets: shared string table, string i is strings[stringOffsets[i]:stringOffsets[i+1]] (utf-8)
+# All string columns are indices into the string table.
+
+subactionDtype = np.dtype([
+    ("index", np.int32),
+    ("shortName", np.int32),
+    ("name", np.int32),
+    ("animOffset", np.uint32),
+    ("animSize", np.uint32),
+    ("eventsOffset", np.uint32),
+    ("firstEvent", np.int32), # row in events
+    ("eventCount", np.int32),
+])
+
+eventDtype = np.dtype([
+    ("subaction", np.int32), # -1 for subroutines
+    ("streamOffset", np.uint32), # eventsOffset of the subaction or offset of the subroutine
+    ("position", np.int32), # index in the event stream
+    ("frame", np.int32), # frame timer before the event (waitFor/waitUntil only, loops and subroutines are ignored)
+    ("commandId", np.uint8),
+    ("name", np.int32),
+    ("offset", np.uint32),
+    ("length", np.uint32),
+])
+
+class StringTable(object):
+    def __init__(self):
+        self.indices = {}
+        self.strings = []
+
+    def add(self, string):
+        if isinstance(string, bytes):
+            string = decodeString(string)
+        if string is None:
+            return -1
+        if string not in self.indices:
+            self.indices[string] = len(self.strings)
+            self.strings.append(string)
+        return self.indices[string]
+
+    def toArrays(self):
+        encoded = [string.encode("utf-8") for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def appendEventRows(rows, strings, events, subactionIndex, streamOffset):
+    frame = 0
+    for position, event in enumerate(events):
+        rows.append((subactionIndex, streamOffset, position, frame, event.commandId,
+            strings.add(event.name), event.offset, event.length))
+        if event.name == "waitFor":
+            frame += event.fields["frames"]
+        elif event.name == "waitUntil":
+            frame = event.fields["frame"]
+
+def exportTables(datFile, ftData):
+    strings = StringTable()
+    subactionRows = []
+    eventRows = []
+    for i, subaction in enumerate(ftData.subactions):
+        firstEvent = len(eventRows)
+        appendEventRows(eventRows, strings, subaction.events, i, subaction.eventsOffset)
+        subactionRows.append((i, strings.add(subaction.shortName), strings.add(subaction.name),
+            subaction.animationOffset, subaction.animationSize, subaction.eventsOffset,
+            firstEvent, len(eventRows) - firstEvent))
+    for offset, subroutine in ftData.subroutines.items():
+        appendEventRows(eventRows, strings, subroutine, -1, offset)
+
+    tables = {}
+    tables["subactions"] = np.array(subactionRows, dtype=subactionDtype)
+    tables["events"] = np.array(eventRows, dtype=eventDtype)
+
+    events = tables["events"]
+    eventTypes = datFile.schema.eventTypes
+    for commandId, eventType in eventTypes.items():
+        if commandId == "default" or not eventType.decoder:
+            continue
+        rows = np.flatnonzero(events["commandId"] == commandId)
+        if len(rows) == 0:
+            continue
+        fields = decodeEvents(datFile.data, events["offset"][rows], commandId, eventTypes)
+        table = np.zeros(len(rows), dtype=np.dtype([("event", np.int32)] + fields.dtype.descr))
+        table["event"] = rows
+        for name in fields.dtype.names:
+            table[name] = fields[name]
+        tables["fields_0x{:02x}".format(commandId)] = table
+
+    tables["strings"], tables["stringOffsets"] = strings.toArrays()
+    return tables
+
+def writeTables(path, tables):
+    # .npz archive, otherwise a directory of .npy files, which np.load(..., mmap_mode="r") can map
+    if path.endswith(".npz"):
+        np.savez(path, **tables)
+    else:
+        os.makedirs(path, exist_ok=True)
+        for name, table in tables.items():
+            np.save(os.path.join(path, name + ".npy"), table)
+
+def readString(tables, index):
+    start, end = tables["stringOffsets"][index], tables["stringOffsets"][index + 1]
+    return bytes(tables["strings"][start:end]).decode("utf-8")
@@ -0,0 +1,71 @@
+from bisect import bisect_left, bisect_right
+from collections import deque
+import struct
+
+# Index of the pointers in the data block of a .dat file, built from its relocation table.
+# Every pointer target (and root node) starts a region, which ends at the next target, so
+# regions approximate the structs, strings and event streams of the file. Lookups use bisect
+# on the sorted locations/region starts.
+
+pointerStruct = struct.Struct(">I")
+
+class PointerIndex(object):
+    def __init__(self, data, relocationTable, roots=()):
+        self.size = len(data)
+        # sorted pointer locations and the offset each one points to
+        self.locations = sorted(relocationTable)
+        self.targets = []
+        for location in self.locations:
+            if location + 4 > self.size:
+                raise ValueError("Relocation table entry {} is out of bounds".format(hex(location)))
+            self.targets.append(pointerStruct.unpack_from(data, location)[0])
+
+        # target -> locations of the pointers to it
+        self.referrers = {}
+        for location, target in zip(self.locations, self.targets):
+            self.referrers.setdefault(target, []).append(location)
+
+        self.regionStarts = sorted(set(target for target in self.targets if target < self.size).union(roots))
+
+    def referencesTo(self, offset):
+        # locations of the pointers to offset
+        return self.referrers.get(offset, [])
+
+    def targetAt(self, location):
+        # the target of the pointer at location or None if there is no pointer
+        i = bisect_left(self.locations, location)
+        if i < len(self.locations) and self.locations[i] == location:
+            return self.targets[i]
+        return None
+
+    def pointersIn(self, start, end):
+        # (location, target) of the pointers in [start, end)
+        first = bisect_left(self.locations, start)
+        last = bisect_left(self.locations, end)
+        return list(zip(self.locations[first:last], self.targets[first:last]))
+
+    def regionOf(self, offset):
+        # (start, end) of the region containing offset, None if it is before the first region
+        i = bisect_right(self.regionStarts, offset) - 1
+        if i < 0 or offset >= self.size:
+            return None
+        end = self.regionStarts[i + 1] if i + 1 < len(self.regionStarts) else self.size
+        return self.regionStarts[i], end
+
+    def reachableRegions(self, roots):
+        # starts of the regions reachable from roots by following pointers
+        reached = set()
+        worklist = deque(roots)
+        while len(worklist) > 0:
+            region = self.regionOf(worklist.popleft())
+            if region is None or region[0] in reached:
+                continue
+            reached.add(region[0])
+            for location, target in self.pointersIn(*region):
+                worklist.append(target)
+        return sorted(reached)
+
+    def unreachableRegions(self, roots):
+        # (start, end) of the regions no pointer path from roots leads to
+        reached = set(self.reachableRegions(roots))
+        return [self.regionOf(start) for start in self.regionStarts if start not in reached]
@@ -0,0 +1,79 @@
+import glob
+import os
+import numpy as np
+
+from .meleedat2json import DatFile, FtData, decodeString
+from .attributes import attributesList, attributesStruct
+
+# Attributes of many characters as one NumPy record array, one row per file, so comparisons
+# across the cast are vector operations:
+#
+#   roster = rosterAttributes(findCharacterFiles("path/to/iso/files"))
+#   roster[np.argsort(roster["gravity"])]["character"]
+#
+# The attribute block of a file is read directly with a big endian dtype (no per-value
+# unpacking). Kirby and Peach have larger blocks, the known attributes are read the same way
+# and "attributesSize" is the real size of the block.
+
+def columnName(index, name):
+    # unknown attributes ("?") are named after their offset in the block
+    if name == "?":
+        return "unknown_0x{:03x}".format(index * 4)
+    return name
+
+attributeColumns = [columnName(i, name) for i, (typeChar, name) in enumerate(attributesList)]
+
+# the attribute block as stored in the files
+blockDtype = np.dtype([(column, ">f4" if typeChar == "f" else ">u4")
+    for column, (typeChar, name) in zip(attributeColumns, attributesList)])
+assert blockDtype.itemsize == attributesStruct.size
+
+rosterDtype = np.dtype([
+    ("character", "U32"),
+    ("sourceFile", "U260"),
+    ("attributesSize", np.uint32),
+] + [(column, blockDtype.fields[column][0].newbyteorder("=")) for column in attributeColumns])
+
+def findCharacterFiles(inputDir, pattern="Pl??.dat"):
+    return [path for path in sorted(glob.glob(os.path.join(inputDir, pattern))) if not path.endswith("AJ.dat")]
+
+def characterName(node):
+    # "ftDataFox" -> "Fox"
+    return decodeString(node.name)[len("ftData"):]
+
+def readAttributeBlock(datFile, ftData):
+    # one record of blockDtype, copied so the file can be closed
+    return np.frombuffer(datFile.data, dtype=blockDtype, count=1, offset=ftData.attributesOffset).copy()[0]
+
+def rosterAttributes(files, errors=None):
+    # files are paths or DatFiles. Files that can't be read raise, unless errors is a list,
+    # then (file, exception) is appended to it and the file is skipped.
+    rows = []
+    for file in files:
+        try:
+            datFile = file if isinstance(file, DatFile) else DatFile(file)
+            try:
+                for node in datFile.rootNodes:
+                    if isinstance(node.data, FtData):
+                        if node.data.attributeValues[0] is None:
+                            raise ValueError("The attributes of {} can't be read".format(decodeString(node.name)))
+                        sourceFile = os.fspath(file) if isinstance(file, (str, os.PathLike)) else ""
+                        rows.append((characterName(node), sourceFile,
+                            node.data.attributesEnd - node.data.attributesOffset, readAttributeBlock(datFile, node.data)))
+            finally:
+                if datFile is not file:
+                    datFile.close()
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.append((file, e))
+
+    roster = np.zeros(len(rows), dtype=rosterDtype)
+    if len(rows) > 0:
+        roster["character"] = [row[0] for row in rows]
+        roster["sourceFile"] = [row[1] for row in rows]
+        roster["attributesSize"] = [row[2] for row in rows]
+        blocks = np.array([row[3] for row in rows], dtype=blockDtype)
+        for column in attributeColumns:
+            roster[column] = blocks[column]
+    return roster
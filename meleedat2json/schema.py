@@ -0,0 +1,266 @@
+from collections import OrderedDict as odict
+import copy
+import json
+import os
+import re
+import bitstruct
+
+from .events import EventType, eventTypes, postProcessHitboxEvent
+
+# Versioned event schemas. The default schema is eventTypes from events.py, variants (e.g. for
+# hacks like 20XX) can be loaded from JSON files that override some of its events, or be
+# derived at runtime:
+#
+#   {"name": "20XX", "version": 1, "base": "default",
+#    "events": {"0x4c": {"length": 4, "name": "autocancel"},
+#               "0xf0": {"length": 8, "name": "custom", "format": "p2u24 u32", "fields": ["a", "b"]}}}
+#
+# An event set to null is removed. For every schema, Python decoders for the event fields are
+# generated once (plain shifts and masks, much faster than bitstruct). They are generated in
+# memory, unless a cache directory is passed to compile() or $MELEEDAT2JSON_CACHE_DIR is set,
+# then they are written there, keyed by a stamp of the definitions, and imported from it.
+#
+# Derived schemas can use postProcess functions that are not registered with
+# registerPostProcess, but such schemas can't be saved with saveSchema.
+
+# increment if the generated code changes, it is part of the stamp
+decoderGeneratorVersion = 1
+
+# postProcess functions schema files can refer to by name
+postProcessors = {
+    "hitbox": postProcessHitboxEvent,
+}
+
+def registerPostProcess(name, function):
+    postProcessors[name] = function
+
+def postProcessName(function):
+    for name, registered in postProcessors.items():
+        if registered is function:
+            return name
+    raise ValueError("postProcess function {} is not registered".format(function.__name__))
+
+def postProcessStampName(function):
+    # unregistered functions are identified by their qualified name in stamps
+    try:
+        return postProcessName(function)
+    except ValueError:
+        return "{}.{}".format(function.__module__, function.__qualname__)
+
+def commandIdKey(commandId):
+    # for sorting, "default" comes last
+    return (1, 0) if commandId == "default" else (0, commandId)
+
+def eventTypeToJson(eventType, nameFunction=postProcessName):
+    entry = odict([("length", eventType.length), ("name", eventType.name)])
+    if eventType.fields:
+        entry["format"] = eventType.fields[0]
+        entry["fields"] = list(eventType.fieldNames)
+        if eventType.postProcess:
+            entry["postProcess"] = nameFunction(eventType.postProcess)
+    return entry
+
+def copyEventType(eventType):
+    # compile() replaces unpack, so schemas must not share their EventTypes
+    copied = copy.copy(eventType)
+    copied.unpack = copied.decoder.unpack if copied.decoder else None
+    return copied
+
+def eventTypeFromJson(entry):
+    # raises ValueError for invalid definitions (the format has to match the fields and length)
+    if not isinstance(entry.get("length"), int) or entry["length"] <= 0:
+        raise ValueError("length has to be a positive integer")
+    fields = None
+    if entry.get("format"):
+        if not isinstance(entry.get("fields"), list):
+            raise ValueError("an event with a format needs a list of fields")
+        fields = (entry["format"], list(entry["fields"]))
+        if entry.get("postProcess"):
+            if entry["postProcess"] not in postProcessors:
+                raise ValueError("unknown postProcess '{}'".format(entry["postProcess"]))
+            fields += (postProcessors[entry["postProcess"]],)
+    try:
+        return EventType(entry["length"], entry.get("name"), fields)
+    except bitstruct.Error as e:
+        raise ValueError("invalid format '{}': {}".format(entry["format"], e)) from None
+
+class EventSchema(object):
+    def __init__(self, name, version, eventTypes):
+        self.name = name
+        self.version = version
+        self.eventTypes = eventTypes
+        # the same tables as events.eventLengths/knownCommands, for scanEvents
+        default = eventTypes["default"]
+        self.eventLengths = [eventTypes.get(i << 2, default).length for i in range(64)]
+        self.knownCommands = [(i << 2) in eventTypes for i in range(64)]
+        self.compiled = False
+        self._stamp = None
+
+    def eventsJsonDict(self, nameFunction=postProcessName):
+        events = odict()
+        for commandId in sorted(self.eventTypes, key=commandIdKey):
+            key = commandId if commandId == "default" else hex(commandId)
+            events[key] = eventTypeToJson(self.eventTypes[commandId], nameFunction)
+        return events
+
+    def toJsonDict(self):
+        return odict([
+            ("name", self.name),
+            ("version", self.version),
+            ("events", self.eventsJsonDict()),
+        ])
+
+    def stamp(self):
+        # changes whenever the definitions (or the decoder generator) change
+        if self._stamp is None:
+            import hashlib
+            data = json.dumps([decoderGeneratorVersion, self.eventsJsonDict(postProcessStampName)])
+            self._stamp = hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+        return self._stamp
+
+    def derive(self, name, version, overrides):
+        # new schema with overrides (commandId -> EventType, or None to remove it) applied
+        derived = dict((commandId, copyEventType(eventType)) for commandId, eventType in self.eventTypes.items())
+        for commandId, eventType in overrides.items():
+            if eventType is None:
+                derived.pop(commandId, None)
+            else:
+                derived[commandId] = copyEventType(eventType)
+        return EventSchema(name, version, derived)
+
+    def compile(self, cacheDir=None):
+        # installs the generated decoders, event types without a generated decoder keep bitstruct
+        if self.compiled:
+            return
+        for commandId, unpack in loadDecoders(self, cacheDir).items():
+            self.eventTypes[commandId].unpack = unpack
+        self.compiled = True
+
+def parseFieldFormat(fieldFormat):
+    # list of (kind, width) or None if the format uses something other than u, s, b and p
+    fieldFormat = fieldFormat.replace(" ", "")
+    layout = [(kind, int(width)) for kind, width in re.findall(r"([a-z])(\d+)", fieldFormat)]
+    if "".join(kind + str(width) for kind, width in layout) != fieldFormat:
+        return None
+    if any(kind not in "usbp" for kind, width in layout):
+        return None
+    return layout
+
+def generateDecoderSource(schema):
+    # Python source of a module with an unpack function per event type with fields and a dict
+    # "decoders" commandId -> function. The functions return the same values as the bitstruct
+    # decoders and also need at least as many bytes as the format covers.
+    lines = ["# Generated by meleedat2json.schema for the schema {} version {} (stamp {}), do not edit".format(
+        schema.name, schema.version, schema.stamp()), ""]
+    decoders = []
+    for commandId in sorted(schema.eventTypes, key=commandIdKey):
+        eventType = schema.eventTypes[commandId]
+        if not eventType.fields:
+            continue
+        layout = parseFieldFormat("p6" + eventType.fields[0])
+        if layout is None:
+            continue
+        totalBits = sum(width for kind, width in layout)
+        byteCount = (totalBits + 7) // 8
+        values = []
+        position = 0
+        for kind, width in layout:
+            if kind != "p":
+                shift = byteCount * 8 - position - width
+                value = "(v >> {}) & {}".format(shift, hex((1 << width) - 1)) if shift > 0 else "v & {}".format(hex((1 << width) - 1))
+                if kind == "s":
+                    value = "(({}) ^ {}) - {}".format(value, hex(1 << (width - 1)), hex(1 << (width - 1)))
+                elif kind == "b":
+                    value = "({}) != 0".format(value)
+                values.append(value)
+            position += width
+
+        function = "unpack_" + ("default" if commandId == "default" else "{:02x}".format(commandId))
+        lines += [
+            "def {}(data):".format(function),
+            "    if len(data) < {}:".format(byteCount),
+            "        raise ValueError('{} needs {} bytes, got {{}}'.format(len(data)))".format(function, byteCount),
+            "    v = int.from_bytes(data[:{}], 'big')".format(byteCount),
+            "    return ({},)".format(", ".join(values)),
+            "",
+        ]
+        decoders.append("    {}: {},".format(repr(commandId), function))
+    lines += ["decoders = {"] + decoders + ["}", ""]
+    return "\n".join(lines)
+
+def decoderCacheDir():
+    # None (no disk cache) unless it is enabled with the environment variable
+    return os.environ.get("MELEEDAT2JSON_CACHE_DIR") or None
+
+def execDecoders(source, moduleName):
+    namespace = {}
+    exec(compile(source, moduleName, "exec"), namespace)
+    return namespace["decoders"]
+
+def loadDecoders(schema, cacheDir=None):
+    # commandId -> generated unpack function, from the disk cache if one is given
+    import importlib.util
+    moduleName = "decoders_" + schema.stamp()
+    cacheDir = cacheDir or decoderCacheDir()
+    if cacheDir is None:
+        return execDecoders(generateDecoderSource(schema), moduleName)
+    path = os.path.join(cacheDir, moduleName + ".py")
+    if not os.path.isfile(path):
+        source = generateDecoderSource(schema)
+        import tempfile
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                f.write(source)
+            os.replace(tempPath, path)
+        except OSError:
+            # no cache, e.g. on a read-only file system
+            return execDecoders(source, moduleName)
+
+    # imported like a module, so the bytecode is cached too
+    spec = importlib.util.spec_from_file_location("meleedat2json." + moduleName, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.decoders
+
+# name -> version -> schema
+schemas = {}
+
+def registerSchema(schema):
+    schemas.setdefault(schema.name, {})[schema.version] = schema
+    return schema
+
+def getSchema(name="default", version=None):
+    # the latest version if version is None
+    versions = schemas.get(name)
+    if not versions:
+        raise KeyError("Unknown schema '{}'".format(name))
+    if version is None:
+        version = max(versions)
+    return versions[version]
+
+def schemaFromJson(data):
+    base = getSchema(data.get("base", "default"), data.get("baseVersion"))
+    overrides = {}
+    for key, entry in data.get("events", {}).items():
+        commandId = key if key == "default" else int(key, 0)
+        try:
+            overrides[commandId] = eventTypeFromJson(entry) if entry is not None else None
+        except ValueError as e:
+            raise ValueError("Invalid event {} in schema '{}': {}".format(key, data.get("name"), e)) from None
+    return base.derive(data["name"], data.get("version", 1), overrides)
+
+def loadSchema(path, register=True):
+    with open(path) as f:
+        schema = schemaFromJson(json.load(f))
+    if register:
+        registerSchema(schema)
+    return schema
+
+def saveSchema(schema, path):
+    # all events, without a base
+    with open(path, "w") as f:
+        json.dump(schema.toJsonDict(), f, indent=4)
+
+defaultSchema = registerSchema(EventSchema("default", 1, eventTypes))
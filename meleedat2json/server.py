@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+from collections import OrderedDict as odict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+import json
+import os
+import socket
+import struct
+
+from .meleedat2json import DatFile, dumpJson, defaultBytesFormat
+
+# A long running server that parses .dat files sent over a local socket (Unix or TCP), so the
+# interpreter start and imports are paid once. Parsing runs in a bounded process pool with a
+# timeout per request and recent results are kept in memory, keyed by a hash of the request.
+#
+# Protocol (both directions): uint32 big endian header length, JSON header, payload.
+#   request header: {"datSize": int, "animSize": int, "sourceFile": str (optional),
+#                    "compact": bool (optional), "bytes": "hex"/"base64"/null (optional)}
+#   request payload: .dat file bytes followed by the AJ file bytes (animSize may be 0)
+#   response header: {"status": "ok" or "error", "error": str, "cached": bool, "size": int}
+#   response payload: the JSON output (utf-8), like the command line tool writes it
+# Several requests can be sent over one connection.
+
+headerLength = struct.Struct(">I")
+maxHeaderSize = 64 * 1024
+
+def parseRequest(fileData, animFileData, sourceFile, compact, bytesFormat):
+    # runs in a worker process
+    datFile = DatFile(fileData, animFileData or None)
+    out = io.StringIO()
+    dumpJson(datFile.toJsonDict(compact, bytesFormat), sourceFile, out, compact)
+    return out.getvalue().encode("utf-8")
+
+def warmUp():
+    # worker initializer, so the first request does not pay for the imports
+    from . import events
+
+class ResultCache(object):
+    # LRU of response payloads, limited by their total size
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.size = 0
+        self.entries = odict()
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.maxSize:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.maxSize:
+            oldKey, oldValue = self.entries.popitem(last=False)
+            self.size -= len(oldValue)
+
+async def readMessage(reader):
+    # returns (header, reader) or None at the end of the stream
+    try:
+        length = headerLength.unpack(await reader.readexactly(headerLength.size))[0]
+    except asyncio.IncompleteReadError:
+        return None
+    if length > maxHeaderSize:
+        raise ValueError("Header too large")
+    return json.loads((await reader.readexactly(length)).decode("utf-8"))
+
+class ParseTimeout(Exception):
+    # the parse did not finish in time, but it can't be stopped and keeps running in future
+    def __init__(self, future):
+        Exception.__init__(self, "Timed out")
+        self.future = future
+
+def packMessage(header, payload=b""):
+    headerData = json.dumps(header).encode("utf-8")
+    return headerLength.pack(len(headerData)) + headerData + payload
+
+class ParseServer(object):
+    def __init__(self, workers=None, timeout=30.0, cacheSize=64*1024*1024, maxRequestSize=64*1024*1024):
+        self.workers = workers or os.cpu_count()
+        self.timeout = timeout
+        self.maxRequestSize = maxRequestSize
+        self.cache = ResultCache(cacheSize)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warmUp)
+        # limits the requests waiting for or running in the pool, created in serve()
+        self.slots = None
+
+    async def process(self, header, fileData, animFileData):
+        compact = bool(header.get("compact", False))
+        bytesFormat = header.get("bytes", defaultBytesFormat(compact))
+        sourceFile = header.get("sourceFile")
+        key = hashlib.sha256(json.dumps([compact, bytesFormat, sourceFile]).encode("utf-8"))
+        key.update(headerLength.pack(len(fileData)))
+        key.update(fileData)
+        key.update(animFileData)
+        key = key.digest()
+
+        result = self.cache.get(key)
+        if result is not None:
+            return result, True
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, parseRequest, fileData, animFileData,
+            sourceFile, compact, bytesFormat)
+        # a running job can't be cancelled, so only the wait is (the shield keeps the future)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise ParseTimeout(future)
+        self.cache.put(key, result)
+        return result, False
+
+    def timedOutJobFinished(self, future):
+        # releases the slot a timed out parse kept
+        if not future.cancelled():
+            future.exception()
+        self.slots.release()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                header = await readMessage(reader)
+                if header is None:
+                    break
+                datSize = int(header.get("datSize", 0))
+                animSize = int(header.get("animSize", 0))
+                if datSize + animSize > self.maxRequestSize:
+                    writer.write(packMessage({"status": "error", "error": "Request too large", "size": 0}))
+                    await writer.drain()
+                    break
+
+                # The slot is held until the parse is done. A timed out parse keeps running in
+                # its worker, so it keeps the slot until it finishes, otherwise slow requests
+                # could fill up the pool while new ones are accepted.
+                await self.slots.acquire()
+                holdsSlot = True
+                try:
+                    fileData = await reader.readexactly(datSize)
+                    animFileData = await reader.readexactly(animSize)
+                    try:
+                        result, cached = await self.process(header, fileData, animFileData)
+                        response = packMessage({"status": "ok", "cached": cached, "size": len(result)}, result)
+                    except ParseTimeout as e:
+                        e.future.add_done_callback(self.timedOutJobFinished)
+                        holdsSlot = False
+                        response = packMessage({"status": "error", "error": "Timed out", "size": 0})
+                    except Exception as e:
+                        response = packMessage({"status": "error", "error": "{}: {}".format(type(e).__name__, e), "size": 0})
+                finally:
+                    if holdsSlot:
+                        self.slots.release()
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, unixPath=None, host="127.0.0.1", port=7431):
+        # more requests have to wait before their payload is read
+        self.slots = asyncio.Semaphore(self.workers * 2)
+        if unixPath:
+            server = await asyncio.start_unix_server(self.handle, path=unixPath)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        # start the workers now
+        await asyncio.get_running_loop().run_in_executor(self.executor, warmUp)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+
+def readExactly(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise ConnectionError("Connection closed by the server after {} of {} bytes".format(len(data), size))
+    return data
+
+def request(address, fileData, animFileData=None, sourceFile=None, compact=False, bytesFormat=None, timeout=None):
+    # Blocking client. address is a path to a Unix socket or a (host, port) tuple.
+    # Returns the JSON output as bytes, raises RuntimeError if the server reports an error and
+    # ConnectionError if it closes the connection before the response is complete.
+    header = {
+        "datSize": len(fileData),
+        "animSize": len(animFileData) if animFileData else 0,
+        "compact": compact,
+    }
+    if sourceFile is not None:
+        header["sourceFile"] = sourceFile
+    # the server uses defaultBytesFormat if it is not given
+    if bytesFormat is not None:
+        header["bytes"] = bytesFormat
+
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall(packMessage(header, bytes(fileData) + bytes(animFileData or b"")))
+        with sock.makefile("rb") as f:
+            length = headerLength.unpack(readExactly(f, headerLength.size))[0]
+            response = json.loads(readExactly(f, length).decode("utf-8"))
+            payload = readExactly(f, response["size"])
+    if response["status"] != "ok":
+        raise RuntimeError(response.get("error"))
+    return payload
+
+def serveMain(argv=None):
+    parser = argparse.ArgumentParser(prog="meleedat2json serve",
+        description="Run a server that parses .dat files sent over a local socket (see server.py for the protocol)")
+    parser.add_argument("--unix", default=None, help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host to listen on")
+    parser.add_argument("--port", type=int, default=7431, help="TCP port to listen on")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Timeout per request in seconds")
+    parser.add_argument("--cachesize", type=int, default=64, help="Size of the in-memory result cache in MiB")
+    args = parser.parse_args(argv)
+
+    server = ParseServer(args.workers, args.timeout, args.cachesize*1024*1024)
+    print("Listening on {}".format(args.unix or "{}:{}".format(args.host, args.port)))
+    try:
+        asyncio.run(server.serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
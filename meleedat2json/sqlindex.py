@@ -0,0 +1,298 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from .meleedat2json import DatFile, FtData, asView, openView, getAnimFilePath, decodeString
+from .schema import defaultSchema
+from .batch import findDatFiles
+
+# SQLite index of the data of many character files, for queries across characters, like
+# "all hitboxes with base knockback > 80 and angle 361". Files are keyed by their path and only
+# indexed again if the hash of the .dat or AJ file changed.
+
+HITBOX = 0x2C
+THROW = 0x88
+
+# the decoded fields of these event types get their own tables
+fieldTables = {
+    HITBOX: "hitboxes",
+    THROW: "throws",
+}
+
+schema = """
+PRAGMA foreign_keys = ON;
+
+CREATE TABLE IF NOT EXISTS characters (
+    id INTEGER PRIMARY KEY,
+    sourceFile TEXT UNIQUE NOT NULL,
+    fileHash TEXT NOT NULL,
+    animFileHash TEXT,
+    nodeName TEXT,
+    indexedAt REAL
+);
+
+CREATE TABLE IF NOT EXISTS attributes (
+    character INTEGER NOT NULL REFERENCES characters(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value,
+    PRIMARY KEY (character, position)
+);
+CREATE INDEX IF NOT EXISTS attributesName ON attributes(name, value);
+
+CREATE TABLE IF NOT EXISTS subactions (
+    character INTEGER NOT NULL REFERENCES characters(id) ON DELETE CASCADE,
+    subaction INTEGER NOT NULL,
+    shortName TEXT,
+    name TEXT,
+    animOffset INTEGER,
+    animSize INTEGER,
+    eventsOffset INTEGER,
+    PRIMARY KEY (character, subaction)
+);
+CREATE INDEX IF NOT EXISTS subactionsShortName ON subactions(shortName);
+
+-- subaction is -1 for events of subroutines
+CREATE TABLE IF NOT EXISTS events (
+    character INTEGER NOT NULL REFERENCES characters(id) ON DELETE CASCADE,
+    subaction INTEGER NOT NULL,
+    streamOffset INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    commandId INTEGER NOT NULL,
+    name TEXT,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS eventsCharacter ON events(character, subaction);
+CREATE INDEX IF NOT EXISTS eventsCommandId ON events(commandId);
+"""
+
+def fieldNames(commandId, eventTypes=defaultSchema.eventTypes):
+    return list(eventTypes[commandId].fieldNames)
+
+# fields of the field tables that get an index, if the event type has them
+indexedFields = ("baseKb", "angle", "damage")
+
+def fieldTableSchema(commandId, eventTypes=defaultSchema.eventTypes):
+    table = fieldTables[commandId]
+    names = fieldNames(commandId, eventTypes)
+    columns = ",\n    ".join(names)
+    indices = "".join("CREATE INDEX IF NOT EXISTS {table}{index} ON {table}({field});\n".format(table=table,
+        index=field[0].upper() + field[1:], field=field) for field in indexedFields if field in names)
+    return """
+CREATE TABLE IF NOT EXISTS {table} (
+    character INTEGER NOT NULL REFERENCES characters(id) ON DELETE CASCADE,
+    subaction INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    {columns}
+);
+CREATE INDEX IF NOT EXISTS {table}Character ON {table}(character, subaction);
+{indices}
+-- with the character file and subaction name
+CREATE VIEW IF NOT EXISTS {table}View AS
+    SELECT characters.sourceFile, subactions.shortName, {table}.*
+    FROM {table}
+    JOIN characters ON characters.id = {table}.character
+    LEFT JOIN subactions ON subactions.character = {table}.character AND subactions.subaction = {table}.subaction;
+""".format(table=table, columns=columns, indices=indices)
+
+def fileHash(data):
+    return hashlib.sha256(asView(data)).hexdigest()
+
+class RosterIndex(object):
+    # eventSchema is the EventSchema the files are parsed with (see schema.py), the field tables
+    # get the field names of its event types
+    def __init__(self, path, eventSchema=None):
+        self.schema = eventSchema if eventSchema is not None else defaultSchema
+        self.db = sqlite3.connect(path)
+        self.db.executescript(schema)
+        for commandId in fieldTables:
+            self.db.executescript(fieldTableSchema(commandId, self.schema.eventTypes))
+        self.db.execute("PRAGMA foreign_keys = ON")
+
+    def close(self):
+        self.db.close()
+
+    def indexFile(self, datFilePath, animFilePath=None):
+        # returns False if the file did not change since it was last indexed
+        with openView(datFilePath) as fileData, openView(animFilePath) as animFileData:
+            return self.indexData(os.path.abspath(datFilePath), fileData, animFileData)
+
+    def indexData(self, sourceFile, fileData, animFileData):
+        datHash = fileHash(fileData)
+        animHash = fileHash(animFileData) if animFileData is not None else None
+
+        row = self.db.execute("SELECT fileHash, animFileHash FROM characters WHERE sourceFile = ?",
+            (sourceFile,)).fetchone()
+        if row == (datHash, animHash):
+            return False
+
+        with DatFile(fileData, animFileData, schema=self.schema) as datFile:
+            ftData = None
+            nodeName = None
+            for node in datFile.rootNodes:
+                if isinstance(node.data, FtData):
+                    ftData = node.data
+                    nodeName = decodeString(node.name)
+                    break
+            self.insertCharacter(sourceFile, datHash, animHash, nodeName, ftData)
+        return True
+
+    def insertCharacter(self, sourceFile, datHash, animHash, nodeName, ftData):
+        with self.db:
+            # replacing the character deletes all of its rows
+            self.db.execute("DELETE FROM characters WHERE sourceFile = ?", (sourceFile,))
+            character = self.db.execute("INSERT INTO characters (sourceFile, fileHash, animFileHash, nodeName, indexedAt) "
+                "VALUES (?, ?, ?, ?, ?)", (sourceFile, datHash, animHash, nodeName, time.time())).lastrowid
+            if ftData:
+                self.insertFtData(character, ftData)
+
+    def insertFtData(self, character, ftData):
+        self.db.executemany("INSERT INTO attributes VALUES (?, ?, ?, ?)",
+            [(character, i, name, value) for i, (name, value) in enumerate(ftData.attributes)])
+
+        streams = []
+        subactionRows = []
+        for i, subaction in enumerate(ftData.subactions):
+            subactionRows.append((character, i, decodeString(subaction.shortName), decodeString(subaction.name),
+                subaction.animationOffset, subaction.animationSize, subaction.eventsOffset))
+            streams.append((i, subaction.eventsOffset, subaction.events))
+        self.db.executemany("INSERT INTO subactions VALUES (?, ?, ?, ?, ?, ?, ?)", subactionRows)
+
+        for offset, subroutine in ftData.subroutines.items():
+            streams.append((-1, offset, subroutine))
+
+        eventRows = []
+        fieldRows = {commandId: [] for commandId in fieldTables}
+        for subaction, streamOffset, events in streams:
+            for position, event in enumerate(events):
+                eventRows.append((character, subaction, streamOffset, position, event.commandId,
+                    event.name, event.offset, event.length))
+                if event.commandId in fieldTables:
+                    fieldRows[event.commandId].append([character, subaction, event.offset]
+                        + list(event.fields.values()))
+        self.db.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)", eventRows)
+
+        for commandId, rows in fieldRows.items():
+            placeholders = ", ".join(["?"] * (3 + len(fieldNames(commandId, self.schema.eventTypes))))
+            self.db.executemany("INSERT INTO {} VALUES ({})".format(fieldTables[commandId], placeholders), rows)
+
+    def indexDirectory(self, inputDir, pattern="Pl??.dat"):
+        # returns the list of files that were (re-)indexed and a list of (file, error) for
+        # files that could not be parsed
+        indexed = []
+        errors = []
+        for datFilePath, animFilePath in findDatFiles(inputDir, pattern):
+            try:
+                if self.indexFile(datFilePath, animFilePath):
+                    indexed.append(datFilePath)
+            except Exception as e:
+                errors.append((datFilePath, "{}: {}".format(type(e).__name__, e)))
+        return indexed, errors
+
+    def query(self, sql, params=()):
+        # returns (column names, rows)
+        cursor = self.db.execute(sql, params)
+        columns = [column[0] for column in cursor.description] if cursor.description else []
+        return columns, cursor.fetchall()
+
+    def viewColumns(self, view):
+        return [row[1] for row in self.db.execute("PRAGMA table_info({})".format(view))]
+
+    def select(self, view, filters=()):
+        # filters is a list of (column, operator, value), rows have to match all of them.
+        # Columns and operators are checked, values are passed as parameters.
+        columns = self.viewColumns(view)
+        conditions = []
+        params = []
+        for column, operator, value in filters:
+            if column not in columns:
+                raise ValueError("Unknown column '{}' in {}".format(column, view))
+            if operator not in filterOperators:
+                raise ValueError("Unknown operator '{}'".format(operator))
+            conditions.append('"{}" {} ?'.format(column, operator))
+            params.append(value)
+        sql = "SELECT * FROM {}".format(view)
+        if len(conditions) > 0:
+            sql += " WHERE " + " AND ".join(conditions)
+        return self.query(sql, params)
+
+    def hitboxes(self, filters=()):
+        return self.select("hitboxesView", filters)
+
+    def throws(self, filters=()):
+        return self.select("throwsView", filters)
+
+filterOperators = ("=", "!=", "<", "<=", ">", ">=")
+
+def parseFilter(text):
+    # "baseKb>80" -> ("baseKb", ">", 80)
+    m = re.match(r"^\s*(\w+)\s*(<=|>=|!=|=|<|>)\s*(.*?)\s*$", text)
+    if not m:
+        raise ValueError("Invalid filter '{}', expected <column><operator><value>".format(text))
+    column, operator, value = m.groups()
+    for convert in (int, float):
+        try:
+            return column, operator, convert(value)
+        except ValueError:
+            pass
+    return column, operator, value
+
+def indexMain(argv=None):
+    parser = argparse.ArgumentParser(prog="meleedat2json index",
+        description="Index the character .dat files in a directory into an SQLite database. Unchanged files are skipped.")
+    parser.add_argument("database", help="Path to the SQLite database")
+    parser.add_argument("inputs", nargs="+", help="Directories containing Pl**.dat and Pl**AJ.dat files or single .dat files")
+    parser.add_argument("--pattern", default="Pl??.dat", help="Glob pattern for the .dat files in directories")
+    args = parser.parse_args(argv)
+
+    index = RosterIndex(args.database)
+    failed = False
+    for path in args.inputs:
+        if os.path.isdir(path):
+            indexed, errors = index.indexDirectory(path, args.pattern)
+        else:
+            animFilePath = getAnimFilePath(path)
+            if not os.path.isfile(animFilePath):
+                animFilePath = None
+            indexed = [path] if index.indexFile(path, animFilePath) else []
+            errors = []
+        for datFilePath in indexed:
+            print("Indexed", datFilePath)
+        for datFilePath, error in errors:
+            print("Failed: {} ({})".format(datFilePath, error))
+            failed = True
+    index.close()
+    if failed:
+        sys.exit(1)
+
+def queryMain(argv=None):
+    parser = argparse.ArgumentParser(prog="meleedat2json query",
+        description="Query an index created with 'meleedat2json index'. Prints tab separated rows.")
+    parser.add_argument("database", help="Path to the SQLite database")
+    parser.add_argument("filters", nargs="*", help="Conditions rows have to match, e.g. \"baseKb>80\" \"angle=361\". Operators: =, !=, <, <=, >, >=")
+    parser.add_argument("--table", default="hitboxes", choices=["hitboxes", "throws"], help="Which table the conditions apply to")
+    parser.add_argument("--sql", default=None, help="Run this SQL query instead")
+    args = parser.parse_args(argv)
+
+    index = RosterIndex(args.database)
+    if args.sql:
+        columns, rows = index.query(args.sql)
+    else:
+        try:
+            filters = [parseFilter(text) for text in args.filters]
+            columns, rows = index.select(args.table + "View", filters)
+        except ValueError as e:
+            index.close()
+            print(e)
+            sys.exit(1)
+    index.close()
+
+    out = sys.stdout
+    out.write("\t".join(columns) + "\n")
+    for row in rows:
+        out.write("\t".join(str(value) for value in row) + "\n")
@@ -0,0 +1,90 @@
+import asyncio
+
+from .meleedat2json import DatFile, FtData
+
+# Incremental access to the subactions of a character file, so callers can process (or send)
+# the first subactions before the rest of the file is decoded. Stop iterating to cancel, the
+# remaining subactions are never decoded.
+#
+#   for index, subaction in iterSubactions("PlFx.dat"): ...
+#   async for index, subactionJson, animationJson in asyncSubactionJson("PlFx.dat", "PlFxAJ.dat"): ...
+
+def getFtData(datFile):
+    for node in datFile.rootNodes:
+        if isinstance(node.data, FtData):
+            return node.data
+    raise ValueError("No ftData root node")
+
+def openDatFile(datFile, animFileData=None):
+    # datFile may already be a DatFile, otherwise anything DatFile accepts. The JSON iterators
+    # close the DatFiles they open when they are done, the others leave that to the garbage
+    # collector, since the yielded subactions use their DatFile.
+    if isinstance(datFile, DatFile):
+        return datFile
+    return DatFile(datFile, animFileData)
+
+def decodeSubaction(ftData, index):
+    # decodes everything toJsonDict would need, except the animation
+    subaction = ftData.subactions[index]
+    subaction.name
+    for event in subaction.events:
+        event.fields
+    return subaction
+
+def subactionJsonFragment(datFile, subaction, animationFileIndex, compact=False, bytesFormat="hex"):
+    # (subaction JSON, animation file JSON or None), like the parts of DatFile.toJsonDict
+    animationJson = None
+    if subaction.animation:
+        animationJson = subaction.animation.toJsonDict()
+    else:
+        animationFileIndex = None
+    return datFile.subactionJsonDict(subaction, animationFileIndex, compact, bytesFormat), animationJson
+
+def iterSubactions(datFile, animFileData=None):
+    # yields (index, FtDataSubaction) with the name and events decoded
+    ftData = getFtData(openDatFile(datFile, animFileData))
+    for i in range(len(ftData.subactions)):
+        yield i, decodeSubaction(ftData, i)
+
+def iterSubactionJson(datFile, animFileData=None, compact=False, bytesFormat="hex"):
+    # yields (index, subaction JSON, animation file JSON or None). "animationFile" in the subaction
+    # JSON is the index of the animation file among the yielded ones, like in toJsonDict.
+    opened = openDatFile(datFile, animFileData)
+    try:
+        ftData = getFtData(opened)
+        animationFileCount = 0
+        for i in range(len(ftData.subactions)):
+            subactionJson, animationJson = subactionJsonFragment(opened, ftData.subactions[i],
+                animationFileCount, compact, bytesFormat)
+            if animationJson is not None:
+                animationFileCount += 1
+            yield i, subactionJson, animationJson
+    finally:
+        if opened is not datFile:
+            opened.close()
+
+async def asyncSubactions(datFile, animFileData=None, executor=None):
+    # like iterSubactions, but every subaction is decoded in the executor (default: the loop's
+    # thread pool), so the event loop keeps running. Cancelling the consumer stops the decoding.
+    loop = asyncio.get_running_loop()
+    datFile = await loop.run_in_executor(executor, openDatFile, datFile, animFileData)
+    ftData = await loop.run_in_executor(executor, getFtData, datFile)
+    for i in range(len(ftData.subactions)):
+        yield i, await loop.run_in_executor(executor, decodeSubaction, ftData, i)
+
+async def asyncSubactionJson(datFile, animFileData=None, compact=False, bytesFormat="hex", executor=None):
+    # like iterSubactionJson, see asyncSubactions
+    loop = asyncio.get_running_loop()
+    opened = await loop.run_in_executor(executor, openDatFile, datFile, animFileData)
+    try:
+        ftData = await loop.run_in_executor(executor, getFtData, opened)
+        animationFileCount = 0
+        for i in range(len(ftData.subactions)):
+            subactionJson, animationJson = await loop.run_in_executor(executor, subactionJsonFragment,
+                opened, ftData.subactions[i], animationFileCount, compact, bytesFormat)
+            if animationJson is not None:
+                animationFileCount += 1
+            yield i, subactionJson, animationJson
+    finally:
+        if opened is not datFile:
+            opened.close()
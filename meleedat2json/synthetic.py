@@ -0,0 +1,184 @@
+import random
+import struct
+
+from .events import eventTypes
+from .attributes import attributesList
+
+# Generates synthetic character .dat files (and matching Pl**AJ.dat animation files) in the
+# format DatFile reads: header, data block, relocation table, root nodes and string table.
+# The data block contains an ftData node with attributes, a subaction table, event streams
+# with a configurable mix of event types, subroutines and references to figatree animations.
+# Used for benchmarks, since real character files can't be shipped.
+
+# control flow is generated explicitly, not drawn from the mix
+controlFlowEvents = [0x00, 0x0C, 0x10, 0x14, 0x18, 0x1C]
+
+def defaultEventMix():
+    # commandId -> weight, roughly like real subactions
+    mix = {}
+    for commandId, eventType in eventTypes.items():
+        if commandId != "default" and commandId not in controlFlowEvents:
+            mix[commandId] = 1
+    mix[0x04] = 6 # waitFor
+    mix[0x08] = 2 # waitUntil
+    mix[0x2C] = 6 # hitbox
+    mix[0x40] = 2 # endAllCollisions
+    mix[0x28] = 3 # gfx
+    mix[0x44] = 3 # sfx
+    return mix
+
+def packDatFile(data, relocations, rootNodes):
+    # rootNodes is a list of (rootOffset, name)
+    stringTable = b""
+    rootNodeData = b""
+    for rootOffset, name in rootNodes:
+        rootNodeData += struct.pack(">2I", rootOffset, len(stringTable))
+        stringTable += name + b"\0"
+    relocationTable = b"".join(struct.pack(">I", offset) for offset in sorted(relocations))
+    body = bytes(data) + relocationTable + rootNodeData + stringTable
+    header = struct.pack(">8I", 0x20 + len(body), len(data), len(relocations), len(rootNodes), 0, 0, 0, 0)
+    return header + body
+
+def generateFigaTree(name, rnd, size=0x200, numFrames=None):
+    # header, bone table, tracks and linear keyframes (see animations.py), padded to size
+    if numFrames is None:
+        numFrames = float(rnd.randint(10, 80))
+    boneCount = rnd.randint(4, 16)
+    bones = [rnd.randint(0, 3) for _ in range(boneCount)]
+    boneTableOffset = 0x14
+    tracksOffset = (boneTableOffset + boneCount + 1 + 3) & ~3
+    keysOffset = tracksOffset + 0xC * sum(bones)
+
+    data = bytearray(struct.pack(">2If2I", 1, 0, numFrames, boneTableOffset, tracksOffset))
+    data += bytes(bones) + b"\xff"
+    data += bytes(tracksOffset - len(data))
+    relocations = [0x0C, 0x10]
+    keys = bytearray()
+    for bone, trackCount in enumerate(bones):
+        for i in range(trackCount):
+            # keyCount - 1 in bits 4-6, linear interpolation, values as s16 / 2^8
+            keyCount = rnd.randint(1, 8)
+            trackKeys = bytearray([((keyCount - 1) << 4) | 0x02])
+            for j in range(keyCount):
+                trackKeys += struct.pack(">hB", rnd.randint(-0x4000, 0x4000), rnd.randint(1, 10))
+            relocations.append(len(data) + 8)
+            data += struct.pack(">H2xBBBxI", len(trackKeys), i + 1, 0x28, 0x28, keysOffset + len(keys))
+            keys += trackKeys
+    data += keys
+    if len(data) < size:
+        data += bytes(rnd.getrandbits(8) for _ in range(size - len(data)))
+    return packDatFile(data, relocations, [(0, name)])
+
+class Generator(object):
+    def __init__(self, seed=0, eventMix=None):
+        self.rnd = random.Random(seed)
+        self.eventMix = eventMix or defaultEventMix()
+        self.mixIds = list(self.eventMix.keys())
+        self.mixWeights = [self.eventMix[commandId] for commandId in self.mixIds]
+        self.data = bytearray()
+        self.relocations = []
+
+    def align(self, alignment=4):
+        while len(self.data) % alignment != 0:
+            self.data.append(0)
+
+    def pointer(self, target):
+        # appends a pointer and marks it in the relocation table
+        self.relocations.append(len(self.data))
+        self.data += struct.pack(">I", target)
+
+    def event(self, commandId):
+        length = eventTypes.get(commandId, eventTypes["default"]).length
+        event = bytearray(self.rnd.getrandbits(8) for _ in range(length))
+        event[0] = commandId | (event[0] & 0x03)
+        if commandId in (0x04, 0x08): # waitFor, waitUntil: keep the frame counts sane
+            struct.pack_into(">I", event, 0, (commandId << 24) | self.rnd.randint(1, 20))
+        self.data += event
+
+    def randomEvents(self, count):
+        for commandId in self.rnd.choices(self.mixIds, self.mixWeights, k=count):
+            self.event(commandId)
+
+    def call(self, commandId, target):
+        self.data += struct.pack(">I", commandId << 24)
+        self.pointer(target)
+
+    def generate(self, subactionCount=300, eventsPerSubaction=(4, 16), subroutineCount=20,
+            subroutineCalls=1, nestedSubroutines=True, animationSize=0x200, sharedAnimations=0.1,
+            name="Synthetic", attributesPadding=0):
+        rnd = self.rnd
+        # ftData header, filled in later
+        self.data += bytes(24)
+
+        attributesOffset = len(self.data)
+        for typeChar, attributeName in attributesList:
+            if typeChar == "f":
+                self.data += struct.pack(">f", rnd.uniform(0.0, 3.0))
+            else:
+                self.data += struct.pack(">I", rnd.randint(0, 10))
+        self.data += bytes(attributesPadding) # Kirby and Peach have larger blocks
+        attributesEnd = len(self.data)
+
+        # subroutines, each one may call the one generated before it
+        subroutines = []
+        for i in range(subroutineCount):
+            subroutines.append(len(self.data))
+            self.randomEvents(rnd.randint(*eventsPerSubaction) // 2 + 1)
+            if nestedSubroutines and i > 0:
+                self.call(0x1C, subroutines[i - 1])
+            self.event(0x18) # return
+
+        # subaction names and event streams
+        names = []
+        for i in range(subactionCount):
+            names.append(len(self.data))
+            self.data += "Ply{}5K_Share_ACTION_Move{}_figatree".format(name, i).encode("utf-8") + b"\0"
+            self.align()
+
+        eventOffsets = []
+        for i in range(subactionCount):
+            eventOffsets.append(len(self.data))
+            count = rnd.randint(*eventsPerSubaction)
+            calls = set(rnd.randrange(count) for _ in range(subroutineCalls)) if subroutines else set()
+            for j in range(count):
+                self.randomEvents(1)
+                if j in calls:
+                    self.call(0x1C, rnd.choice(subroutines))
+            self.event(0x00) # exit
+
+        # animations
+        animFileData = bytearray()
+        animations = []
+        for i in range(subactionCount):
+            if animationSize <= 0:
+                animations.append((0, 0))
+            elif i > 0 and animations[-1][1] > 0 and rnd.random() < sharedAnimations:
+                animations.append(animations[-1])
+            else:
+                figaTree = generateFigaTree("Ply{}5K_Share_ACTION_Move{}_figatree".format(name, i).encode("utf-8"),
+                    rnd, animationSize)
+                animations.append((len(animFileData), len(figaTree)))
+                animFileData += figaTree
+                while len(animFileData) % 0x20 != 0:
+                    animFileData.append(0)
+
+        # subaction table
+        subactionsOffset = len(self.data)
+        for i in range(subactionCount):
+            self.pointer(names[i])
+            self.data += struct.pack(">2I", *animations[i])
+            self.pointer(eventOffsets[i])
+            self.data += struct.pack(">HHI", 0, 0, 0)
+        subactionsEnd = len(self.data)
+
+        # ftData header
+        header = (attributesOffset, attributesEnd, 0, subactionsOffset, 0, subactionsEnd)
+        struct.pack_into(">6I", self.data, 0, *header)
+        self.relocations += [0, 4, 12, 20]
+
+        datFileData = packDatFile(self.data, self.relocations, [(0, "ftData{}".format(name).encode("utf-8"))])
+        return datFileData, bytes(animFileData)
+
+def generateDatFile(seed=0, eventMix=None, **kwargs):
+    # returns (.dat file bytes, AJ file bytes), see Generator.generate for the options
+    return Generator(seed, eventMix).generate(**kwargs)
@@ -0,0 +1,155 @@
+import math
+import weakref
+import numpy as np
+
+from .meleedat2json import FigaTree
+from .events import hitboxFixedPointFields
+
+# Runs the events of a subaction like the game does and records the resulting state for every frame.
+# Row i of the arrays is frame i + 1 (frames are counted from 1, like in frame data listings).
+#   hitboxSlots[i, id]: index into hitboxes of the hitbox with that id active on frame i + 1, -1 if none
+#   bodyState[i]: 0 = normal, 1 = invulnerable, 2 = intangible (from bodyCollisionState)
+#   autocancel[i]: whether landing on that frame autocancels. Every autocancel event toggles it.
+# iasaFrame is the first frame with allowIasa or None.
+
+hitboxSlotCount = 8 # hitbox ids are 3 bits
+maxSteps = 100000 # guard against endless loops/gotos
+maxFrames = 10000 # guard against garbage wait times
+
+class Timeline(object):
+    def __init__(self, frameCount, hitboxes, spans, iasaFrame):
+        self.frameCount = frameCount
+        # copies of the fields of hitbox events, adjustHitbox* events create modified copies
+        self.hitboxes = hitboxes
+        self.iasaFrame = iasaFrame
+
+        self.hitboxSlots = np.full((frameCount, hitboxSlotCount), -1, dtype=np.int32)
+        self.bodyState = np.zeros(frameCount, dtype=np.uint8)
+        self.autocancel = np.ones(frameCount, dtype=np.bool_)
+        for start, end, slots, bodyState, autocancel in spans:
+            self.hitboxSlots[start:end] = slots
+            self.bodyState[start:end] = bodyState
+            self.autocancel[start:end] = autocancel
+
+    def activeHitboxes(self, frame):
+        return [self.hitboxes[i] for i in self.hitboxSlots[frame - 1] if i >= 0]
+
+    def activeFrames(self):
+        # frames with at least one hitbox
+        return np.flatnonzero((self.hitboxSlots >= 0).any(axis=1)) + 1
+
+class Interpreter(object):
+    def __init__(self, datFile):
+        self.datFile = datFile
+
+    def getEvents(self, offset):
+        # the full stream from the event cache, shared with FtData.subroutines
+        return self.datFile.getEvents(offset)
+
+    def run(self, subaction):
+        timer = 0
+        slots = [-1] * hitboxSlotCount
+        bodyState = 0
+        autocancel = True
+        hitboxes = []
+        spans = []
+        iasaFrame = None
+
+        events, position = subaction.events, 0
+        callStack = []
+        loopStack = []
+        steps = 0
+        while steps < maxSteps:
+            steps += 1
+            if position >= len(events):
+                if len(callStack) == 0:
+                    break
+                events, position = callStack.pop()
+                continue
+
+            event = events[position]
+            position += 1
+            name = event.name
+            fields = event.fields
+
+            waitFrames = 0
+            if name == "exit":
+                break
+            elif name == "waitFor":
+                waitFrames = fields["frames"]
+            elif name == "waitUntil":
+                waitFrames = max(0, fields["frame"] - timer)
+            elif name == "setLoop":
+                loopStack.append([events, position, fields["loopCount"]])
+            elif name == "executeLoop":
+                if len(loopStack) > 0:
+                    loopStack[-1][2] -= 1
+                    if loopStack[-1][2] > 0:
+                        events, position = loopStack[-1][0], loopStack[-1][1]
+                    else:
+                        loopStack.pop()
+            elif name == "subroutine":
+                callStack.append((events, position))
+                events, position = self.getEvents(int(fields["location"])), 0
+            elif name == "goto":
+                events, position = self.getEvents(int(fields["location"])), 0
+            elif name == "return":
+                if len(callStack) == 0:
+                    break
+                events, position = callStack.pop()
+            elif name == "hitbox":
+                hitbox = dict(fields)
+                hitbox["frame"] = timer + 1
+                slots[fields["id"]] = len(hitboxes)
+                hitboxes.append(hitbox)
+            elif name == "adjustHitboxDamage" or name == "adjustHitboxSize":
+                slot = fields["hitboxId"]
+                if slot < hitboxSlotCount and slots[slot] >= 0:
+                    field = "damage" if name == "adjustHitboxDamage" else "size"
+                    hitbox = dict(hitboxes[slots[slot]])
+                    # same fixed point scaling as postProcessHitboxEvent
+                    hitbox[field] = fields[field] / 255 if field in hitboxFixedPointFields else fields[field]
+                    slots[slot] = len(hitboxes)
+                    hitboxes.append(hitbox)
+            elif name == "endOneCollision":
+                if fields["hitboxId"] < hitboxSlotCount:
+                    slots[fields["hitboxId"]] = -1
+            elif name == "endAllCollisions":
+                slots = [-1] * hitboxSlotCount
+            elif name == "bodyCollisionState":
+                bodyState = fields["state"]
+            elif name == "autocancel":
+                autocancel = not autocancel
+            elif name == "allowIasa":
+                if iasaFrame is None:
+                    iasaFrame = timer + 1
+
+            waitFrames = min(waitFrames, maxFrames - timer)
+            if waitFrames > 0:
+                spans.append((timer, timer + waitFrames, list(slots), bodyState, autocancel))
+                timer += waitFrames
+                if timer >= maxFrames:
+                    break
+
+        frameCount = min(max(timer, self.animationFrameCount(subaction), 1), maxFrames)
+        spans.append((timer, frameCount, list(slots), bodyState, autocancel))
+        return Timeline(frameCount, hitboxes, spans, iasaFrame)
+
+    @staticmethod
+    def animationFrameCount(subaction):
+        animation = subaction.animation
+        if animation:
+            for node in animation.rootNodes:
+                if isinstance(node.data, FigaTree):
+                    return int(math.ceil(node.data.numFrames))
+        return 0
+
+# timelines are memoized per subaction
+timelineCache = weakref.WeakKeyDictionary()
+
+def getTimeline(subaction):
+    timeline = timelineCache.get(subaction)
+    if timeline is None:
+        timeline = Interpreter(subaction.datFile).run(subaction)
+        timelineCache[subaction] = timeline
+    return timeline
@@ -11,7 +11,10 @@ setup(name='meleedat2json',
     install_requires=[
       'bitstruct',
     ],
+    extras_require={
+      'numpy': ['numpy'],
+    },
     entry_points = {
-        'console_scripts': ['meleedat2json=meleedat2json:main'],
+        'console_scripts': ['meleedat2json=meleedat2json.cli:main'],
     },
     zip_safe=False)